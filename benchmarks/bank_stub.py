@@ -0,0 +1,110 @@
+import argparse
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+from threading import Lock, Thread
+from time import sleep
+from urllib.parse import urlsplit
+
+from scraper.direct import NIS_RESPONSE, load_endpoints
+
+log = logging.getLogger(__name__)
+
+
+# answers the requests --direct replays with responses recorded from the
+# bank, so a run with --direct-base-url pointing here never leaves the host.
+# every request is kept for the caller to inspect
+class BankStub:
+    def __init__(self, responses: dict, latency: float = 0.0, port: int = 0):
+        # path -> json reply, served for any method and query string
+        self.responses = responses
+        self.latency = latency
+        self.lock = Lock()
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub.handle(self, 'GET')
+
+            def do_POST(self):
+                stub.handle(self, 'POST')
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    @classmethod
+    def from_recording(cls, state_dir: str, record_dir: str, **kwargs):
+        # the endpoint learned into state_dir, answered with the reply a
+        # --record run saved next to the grid rows
+        spec = load_endpoints(state_dir)['nis']
+        with open(path.join(record_dir, NIS_RESPONSE), encoding='utf-8') as f:
+            response = json.load(f)
+        return cls({urlsplit(spec['url']).path: response}, **kwargs)
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, request: BaseHTTPRequestHandler, method: str):
+        if self.latency:
+            sleep(self.latency)
+        length = int(request.headers.get('Content-Length') or 0)
+        body = request.rfile.read(length).decode() if length else ''
+        with self.lock:
+            self.requests.append({'method': method, 'url': request.path,
+                                  'body': body})
+        response = self.responses.get(urlsplit(request.path).path)
+        status = 200 if response is not None else 404
+        data = json.dumps(
+            response if response is not None
+            else {'error': f'no recording for {method} {request.path}'},
+            ensure_ascii=False,
+        ).encode()
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json; charset=utf-8')
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='serves a recorded nis grid reply for --direct-base-url'
+    )
+    parser.add_argument('--state-dir', default='state')
+    parser.add_argument('--record-dir', required=True,
+                        help='the directory a --record run wrote')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    with BankStub.from_recording(args.state_dir, args.record_dir,
+                                 latency=args.latency_ms / 1000,
+                                 port=args.port) as stub:
+        log.info(f'serving recorded bank replies on {stub.endpoint}')
+        try:
+            stub.thread.join()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
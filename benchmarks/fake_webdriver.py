@@ -0,0 +1,84 @@
+from math import ceil
+from time import sleep
+from typing import List
+
+from scraper.common import Transaction
+from scraper.mizrahi import GRID_PAGER_SCRIPT, GRID_ROWS_SCRIPT
+from scraper.readiness import GRID_READY_SCRIPT, GRID_SIGNATURE_SCRIPT, \
+    PAGE_IDLE_SCRIPT
+
+from benchmarks.synthetic import NIS_COLUMNS, kendo_grid_html, nis_cells
+
+
+# answers the scripts the scraper runs against a kendo grid from a synthetic
+# transaction list, every command can be delayed to model the round trip to
+# a remote grid node
+class FakeWebDriver:
+    def __init__(self, transactions: List[Transaction], page_size=50,
+                 page_sizes=(50, 100, 500, 1000), latency: float = 0.0):
+        self.transactions = transactions
+        self.page_size = page_size
+        self.page_sizes = page_sizes
+        self.latency = latency
+        self.page = 1
+        self.commands = 0
+
+    def command(self):
+        self.commands += 1
+        if self.latency:
+            sleep(self.latency)
+
+    @property
+    def total_pages(self) -> int:
+        return max(1, ceil(len(self.transactions) / self.page_size))
+
+    def current_rows(self) -> List[Transaction]:
+        start = (self.page - 1) * self.page_size
+        return self.transactions[start:start + self.page_size]
+
+    @property
+    def page_source(self) -> str:
+        self.command()
+        return kendo_grid_html(self.current_rows())
+
+    def implicitly_wait(self, seconds):
+        self.command()
+
+    def find_elements(self, by, value) -> list:
+        self.command()
+        return []
+
+    def get_cookies(self) -> List[dict]:
+        self.command()
+        return []
+
+    def execute_script(self, script: str, *args):
+        self.command()
+        if script == GRID_ROWS_SCRIPT:
+            return [
+                [[name, text] for name, text in zip(NIS_COLUMNS, nis_cells(t))]
+                for t in self.current_rows()
+            ]
+        if script == GRID_SIGNATURE_SCRIPT:
+            rows = self.current_rows()
+            return '\t'.join(nis_cells(rows[0])) if rows else None
+        if script == GRID_PAGER_SCRIPT:
+            if args[0] == 'maximize':
+                largest = max(self.page_sizes)
+                if self.page_size >= largest:
+                    return None
+                self.page_size = largest
+                self.page = 1
+                return largest
+            if args[0] == 'next':
+                if self.page >= self.total_pages:
+                    return False
+                self.page += 1
+                return True
+            return None
+        if script in (PAGE_IDLE_SCRIPT, GRID_READY_SCRIPT):
+            return True
+        return None
+
+    def quit(self):
+        pass
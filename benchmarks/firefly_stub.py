@@ -0,0 +1,193 @@
+import json
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import ceil
+from threading import Lock, Thread
+from time import sleep
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+# codes as the uploader files them, the scraper calls shekels nis
+CURRENCIES = ('NIS', 'USD', 'EUR', 'GBP')
+ACCOUNT = re.compile(r'^/api/v1/accounts/(\d+)$')
+ACCOUNT_TRANSACTIONS = re.compile(r'^/api/v1/accounts/(\d+)/transactions$')
+
+
+# in-process stand-in for the parts of the firefly api the uploader talks
+# to, every response is delayed by a fixed latency
+class FireflyStub:
+    def __init__(self, latency: float = 0.0, port: int = 0):
+        self.latency = latency
+        self.lock = Lock()
+        self.accounts = []
+        self.account_ids = 0
+        self.groups = []
+        self.references = set()
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub.handle(self, 'GET')
+
+            def do_POST(self):
+                stub.handle(self, 'POST')
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_account(self, name: str, account_number: str,
+                    currency_code: str = 'NIS',
+                    opening_balance: float = 0.0) -> dict:
+        with self.lock:
+            self.account_ids += 1
+            account = {
+                'type': 'accounts',
+                'id': str(self.account_ids),
+                'attributes': {
+                    'name': name,
+                    'type': 'asset',
+                    'account_number': account_number,
+                    'currency_code': currency_code,
+                    'current_balance': str(opening_balance),
+                },
+            }
+            self.accounts.append(account)
+            return account
+
+    def add_transaction(self, account_id: str, t_date: str, amount: float,
+                        internal_reference: str) -> Optional[dict]:
+        with self.lock:
+            if internal_reference in self.references:
+                return None
+            self.references.add(internal_reference)
+            group = {
+                'type': 'transactions',
+                'id': str(len(self.groups) + 1),
+                'attributes': {'transactions': [{
+                    'date': t_date,
+                    'amount': str(amount),
+                    'source_id': account_id,
+                    'destination_id': account_id,
+                    'internal_reference': internal_reference,
+                }]},
+            }
+            self.groups.append(group)
+            return group
+
+    def move(self, account_id: str, amount: float):
+        with self.lock:
+            for account in self.accounts:
+                if account['id'] == account_id:
+                    attributes = account['attributes']
+                    attributes['current_balance'] = str(
+                        float(attributes['current_balance']) + amount
+                    )
+
+    def handle(self, request: BaseHTTPRequestHandler, method: str):
+        if self.latency:
+            sleep(self.latency)
+        with self.lock:
+            self.requests += 1
+        url = urlsplit(request.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(request.headers.get('Content-Length') or 0)
+        body = json.loads(request.rfile.read(length) or b'{}') \
+            if length else {}
+        status, payload = self.route(method, url.path, query, body)
+        data = json.dumps(payload).encode()
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def route(self, method, path, query, body):
+        if method == 'GET' and path == '/api/v1/about':
+            return 200, {'data': {'version': 'stub', 'api_version': 'stub'}}
+        if method == 'GET' and path == '/api/v1/currencies':
+            return 200, self.page([
+                {'type': 'currencies', 'id': str(i + 1),
+                 'attributes': {'code': code}}
+                for i, code in enumerate(CURRENCIES)
+            ], query)
+        if method == 'GET' and path == '/api/v1/accounts':
+            return 200, self.page(list(self.accounts), query)
+        match = ACCOUNT.match(path)
+        if method == 'GET' and match:
+            for account in self.accounts:
+                if account['id'] == match.group(1):
+                    return 200, {'data': account}
+            return 404, {'message': 'Resource not found'}
+        if method == 'POST' and path == '/api/v1/accounts':
+            return 200, {'data': self.add_account(
+                body.get('name', ''), body.get('account_number', ''),
+                body.get('currency_code', 'NIS'),
+                float(body.get('opening_balance') or 0),
+            )}
+        match = ACCOUNT_TRANSACTIONS.match(path)
+        if method == 'GET' and (match or path == '/api/v1/transactions'):
+            account_id = match.group(1) if match else None
+            if account_id and all(a['id'] != account_id
+                                  for a in self.accounts):
+                return 404, {'message': 'Resource not found'}
+            start, end = query.get('start'), query.get('end')
+            with self.lock:
+                groups = [
+                    g for g in self.groups
+                    for t in g['attributes']['transactions'][:1]
+                    if (account_id is None or account_id in (
+                        t['source_id'], t['destination_id']))
+                    and (not start or t['date'][:10] >= start)
+                    and (not end or t['date'][:10] <= end)
+                ]
+            return 200, self.page(groups, query)
+        if method == 'POST' and path == '/api/v1/transactions':
+            split = body['transactions'][0]
+            account_id = split['destination_id'] \
+                if split['source_id'] == '4' else split['source_id']
+            group = self.add_transaction(account_id, split['date'],
+                                         split['amount'],
+                                         split['internal_reference'])
+            if group is None:
+                return 422, {'message': 'Duplicate of transaction #1.'}
+            # transfers from the cash wallet (id 4) add to the account
+            amount = float(split['amount'])
+            self.move(account_id,
+                      amount if split['source_id'] == '4' else -amount)
+            return 200, {'data': group}
+        return 404, {'message': f'no stub for {method} {path}'}
+
+    @staticmethod
+    def page(items, query) -> dict:
+        limit = int(query.get('limit') or 50)
+        page = int(query.get('page') or 1)
+        total_pages = max(1, ceil(len(items) / limit))
+        return {
+            'data': items[(page - 1) * limit:page * limit],
+            'meta': {'pagination': {
+                'total': len(items), 'count': limit,
+                'per_page': limit, 'current_page': page,
+                'total_pages': total_pages,
+            }},
+        }
@@ -0,0 +1,168 @@
+import argparse
+import json
+import logging
+from math import ceil
+from os import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from scraper.common import ScrapeOptions, ScrapeResults, id_for_transaction
+from scraper.firefly import FireflyClient, UploadOptions, firefly_upload
+from scraper.ledger import Ledger
+from scraper.mizrahi import MAX_GRID_PAGES, parse_foreign_transactions, \
+    parse_stocks, read_nis_grid
+
+from benchmarks.fake_webdriver import FakeWebDriver
+from benchmarks.firefly_stub import FireflyStub
+from benchmarks.synthetic import foreign_transactions_html, make_results, \
+    make_transactions, stocks_html
+
+log = logging.getLogger(__name__)
+
+
+def measure(name: str, size: int, func, *args) -> dict:
+    # func may return a dict of extra figures to report next to the timing
+    started = perf_counter()
+    extra = func(*args) or {}
+    seconds = perf_counter() - started
+    outcome = {
+        'benchmark': name,
+        'size': size,
+        'seconds': seconds,
+        'per_second': size / max(seconds, 1e-9),
+        **extra,
+    }
+    log.info(f"{name:<24} {size:>9} {seconds:>9.3f}s "
+             f"{outcome['per_second']:>12.0f}/s "
+             + ' '.join(f'{k}={v}' for k, v in extra.items()))
+    return outcome
+
+
+def bench_nis_grid(size: int, latency: float) -> dict:
+    transactions = make_transactions(size)
+    # the grid offers a page size large enough to stay under the page cap
+    largest = max(1000, ceil(size / MAX_GRID_PAGES))
+    driver = FakeWebDriver(transactions, page_sizes=(50, 100, 500, largest),
+                           latency=latency)
+    result = ScrapeResults('Mizrahi Tefahot', '123-456789')
+
+    def run():
+        read_nis_grid(driver, result, ScrapeOptions())
+        assert len(result.transactions['nis']) == size
+        return {'webdriver_commands': driver.commands}
+
+    return measure('nis grid', size, run)
+
+
+def bench_foreign(size: int) -> dict:
+    source = foreign_transactions_html(make_transactions(size))
+
+    def run():
+        parse_foreign_transactions(source)
+
+    return measure('foreign transactions', size, run)
+
+
+def bench_stocks(size: int) -> dict:
+    source = stocks_html(size)
+
+    def run():
+        assert len(parse_stocks(source)) == size
+
+    return measure('stocks', size, run)
+
+
+def bench_hashing(size: int) -> dict:
+    result = make_results(size)
+    entries = [
+        (currency, entry)
+        for currency, transactions in result.transactions.items()
+        for entry in transactions
+    ]
+
+    def run():
+        for currency, entry in entries:
+            id_for_transaction(entry, currency, result.account)
+
+    return measure('id_for_transaction', len(entries), run)
+
+
+def bench_firefly(size: int, latency: float, workers: int,
+                  state_dir: str) -> list:
+    result = make_results(size)
+    total = sum(map(len, result.transactions.values()))
+    outcomes = []
+    with FireflyStub(latency) as stub:
+        client = FireflyClient(stub.endpoint, token='benchmark')
+        try:
+            def upload(options):
+                before = stub.requests
+                failures = firefly_upload(result, client, options)
+                assert not any(failures.values())
+                return {'requests': stub.requests - before}
+
+            outcomes.append(measure(
+                f'upload x{workers}', total, upload,
+                UploadOptions(workers=workers),
+            ))
+            # everything is in firefly now, so this is listing and diffing
+            outcomes.append(measure(
+                'reconcile', total, upload, UploadOptions(workers=workers),
+            ))
+            ledger = Ledger(path.join(state_dir, f'ledger-{size}.sqlite3'))
+            try:
+                outcomes.append(measure(
+                    'reconcile into ledger', total, upload,
+                    UploadOptions(workers=workers, ledger=ledger),
+                ))
+                outcomes.append(measure(
+                    'ledger only', total, upload,
+                    UploadOptions(workers=workers, ledger=ledger),
+                ))
+            finally:
+                ledger.close()
+        finally:
+            client.close()
+    assert len(stub.references) == total
+    return outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='measures scraper and uploader throughput against a fake '
+                    'webdriver and a local firefly stub'
+    )
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000],
+                        help='transaction counts to parse and hash')
+    parser.add_argument('--upload-sizes', type=int, nargs='+',
+                        default=[1000],
+                        help='transaction counts to push through the stub')
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help='delay added to every webdriver command and '
+                             'firefly response')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='concurrent uploads')
+    parser.add_argument('--out', help='write the results as json')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    logging.getLogger('scraper').setLevel(logging.WARNING)
+
+    latency = args.latency_ms / 1000
+    outcomes = []
+    for size in args.sizes:
+        outcomes.append(bench_nis_grid(size, latency))
+        outcomes.append(bench_foreign(size))
+        outcomes.append(bench_stocks(min(size, 10000)))
+        outcomes.append(bench_hashing(size))
+    with TemporaryDirectory() as state_dir:
+        for size in args.upload_sizes:
+            outcomes.extend(bench_firefly(size, latency, args.workers,
+                                          state_dir))
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(outcomes, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import random
+from datetime import date, timedelta
+from html import escape
+from typing import List
+
+from scraper.common import ScrapeResults, Transaction
+
+NIS_COLUMNS = ('לחץ לפתיחת הרחבה', 'תאריך', 'תאריך ערך', 'סוג תנועה',
+               'אסמכתה', 'זכות/חובה', 'יתרה בש"ח', '', 'הערות')
+DESCRIPTIONS = ('העברה', 'משכורת', 'כרטיס אשראי', 'הוראת קבע', 'משיכת מזומן',
+                'ריבית', 'עמלה', 'הפקדה')
+
+
+def make_transactions(n: int, seed: int = 0, newest: date = None) \
+        -> List[Transaction]:
+    # newest first like the bank lists them, balances add up backwards
+    rng = random.Random(seed)
+    day = newest or date.today()
+    balance = round(rng.uniform(1000, 50000), 2)
+    transactions = []
+    for i in range(n):
+        value = round(rng.uniform(-2500, 2500), 2)
+        transactions.append(Transaction(
+            day,
+            day + timedelta(days=rng.choice((0, 0, 1, 2))),
+            rng.choice(DESCRIPTIONS),
+            str(100000 + i),
+            value,
+            balance,
+        ))
+        balance = round(balance - value, 2)
+        if rng.random() < 0.3:
+            day -= timedelta(days=1)
+    return transactions
+
+
+def make_results(n: int, seed: int = 0) -> ScrapeResults:
+    result = ScrapeResults('Mizrahi Tefahot', '123-456789')
+    share = {'nis': 0.8, 'usd': 0.15, 'eur': 0.05}
+    for offset, (currency, fraction) in enumerate(share.items()):
+        result.transactions[currency] = make_transactions(
+            max(1, int(n * fraction)), seed + offset
+        )
+    result.nis, result.usd, result.eur = (
+        result.transactions[c][0].balance for c in share
+    )
+    return result
+
+
+def nis_cells(t: Transaction) -> List[str]:
+    return [
+        '',
+        t.date.strftime('%d/%m/%y'),
+        t.value_date.strftime('%d/%m/%y'),
+        t.description,
+        t.serial,
+        f'{t.value:,.2f}',
+        f'{t.balance:,.2f} ₪',
+        '',
+        '',
+    ]
+
+
+def kendo_grid_html(transactions: List[Transaction]) -> str:
+    header = ''.join(
+        f'<th role="columnheader" data-title="{escape(c)}">{escape(c)}</th>'
+        for c in NIS_COLUMNS
+    )
+    rows = ''.join(
+        '<tr class="k-master-row" role="row">' + ''.join(
+            f'<td role="gridcell">{escape(cell)}</td>' for cell in nis_cells(t)
+        ) + '</tr>'
+        for t in transactions
+    )
+    return (
+        '<html><body><div class="k-grid k-widget">'
+        f'<div class="k-grid-header"><table><thead><tr>{header}</tr></thead>'
+        '</table></div><div class="k-grid-content"><table><tbody>'
+        f'{rows}</tbody></table></div></div></body></html>'
+    )
+
+
+def foreign_transactions_html(transactions: List[Transaction]) -> str:
+    panel = 'ctl00_ContentPlaceHolder2_Repeater1_ctl00' \
+            '_ctl00_ContentPlaceHolder2_Repeater1_ctl00_PageAjaxPanel1Panel'
+    label = 'ctl00_ContentPlaceHolder2_Repeater1_ctl00_lblShemMatbea'
+    rows = ''.join(
+        '<tr>' + ''.join(f'<td>{escape(c)}</td>' for c in (
+            t.date.strftime('%d/%m/%y'),
+            t.value_date.strftime('%d/%m/%y'),
+            t.description,
+            t.serial,
+            f'{t.value:,.2f}',
+            f'{t.balance:,.2f}',
+        )) + '</tr>'
+        for t in transactions
+    )
+    return (
+        f'<html><body><span id="{label}">דולר</span><div id="{panel}">'
+        '<table><tr><th>תאריך</th><th>תאריך ערך</th><th>תיאור</th>'
+        '<th>אסמכתה</th><th>סכום</th><th>יתרה</th></tr>'
+        f'{rows}</table></div></body></html>'
+    )
+
+
+def stocks_html(n: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n):
+        lines = [
+            '-', f'Synthetic Holding {i}', str(1000000 + i), 'TASE',
+            f'{rng.uniform(10, 5000):,.2f}', '-', '-', '-',
+            f'{rng.randint(1, 2000):,}', '-', '-', '-', '-',
+            f'{rng.uniform(-30, 80):.2f}%', f'{rng.uniform(-5e4, 1e5):,.2f}',
+        ]
+        rows.append(
+            '<tr class="k-master-row"><td>'
+            + ''.join(f'<div>{escape(line)}</div>' for line in lines)
+            + '</td></tr>'
+        )
+    return '<html><body><div class="miz-notification-messages"></div>' \
+           '<div class="k-grid"><table>' + ''.join(rows) + \
+           '</table></div></body></html>'
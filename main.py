@@ -1,32 +1,358 @@
 import argparse
 import logging
+from copy import copy
+from datetime import timedelta
+from functools import partial
+from os import path
 from sys import stderr, exc_info
 from traceback import print_exception
 
-from selenium.webdriver import DesiredCapabilities
-from selenium.webdriver.remote.remote_connection import LOGGER
-
-from scraper.firefly import firefly_upload
-from scraper.mizrahi import scrape
+from scraper.batch import load_profiles, profile_value, run_batch
+from scraper.firefly import firefly_upload, FireflyClient, UploadOptions, \
+    push_net_worth
+from scraper.journal import Journal
+from scraper.ledger import Ledger
+from scraper.metadata import MetadataCache
+from scraper.metrics import METRICS
+from scraper.common import ScrapeOptions
+from scraper.daemon import run_forever
+from scraper.results import read_results, write_results
+from scraper.stocks import StockStore, portfolio_value
+from scraper.stream import UploadStream
+from scraper.state import load_watermarks, save_watermarks, \
+    advance_watermarks
 
 
 def main():
     logging.basicConfig()
-    LOGGER.setLevel(logging.INFO)
     parser = argparse.ArgumentParser(description="scrape data")
+    parser.add_argument('--mode', choices=('scrape', 'upload', 'both'),
+                        default='both',
+                        help='scrape into --results, upload from it, or both '
+                             'in one process')
+    parser.add_argument('--results', metavar='FILE',
+                        help='scrape results as jsonl, .gz to compress, '
+                             'defaults to results.jsonl in --state-dir')
     parser.add_argument("--target", default="http://127.0.0.1:4444")
     parser.add_argument("--browser", default="chrome")
+    parser.add_argument('--browser-profile', choices=('default', 'lean'),
+                        default='default',
+                        help='lean loads pages eagerly, headless, without '
+                             'images, trackers or media')
+    parser.add_argument('--headed', action='store_true',
+                        help='show the browser window with the lean profile')
     parser.add_argument("--type", default="mizrahi")
     parser.add_argument('--firefly', default='http://firefly.web.svc:8080')
+    parser.add_argument('--record', metavar='DIR',
+                        help='save page snapshots while scraping')
+    parser.add_argument('--replay', metavar='DIR',
+                        help='parse recorded snapshots instead of scraping')
+    parser.add_argument('--state-dir', default='state')
+    parser.add_argument('--full-resync', action='store_true',
+                        help='ignore sync watermarks and scrape everything')
+    parser.add_argument('--overlap-days', type=int, default=7)
+    parser.add_argument('--keep-session', action='store_true',
+                        help='reuse the bank session between runs')
+    parser.add_argument('--direct', action='store_true',
+                        help='fetch grid data over http after the login')
+    parser.add_argument('--direct-base-url',
+                        help='send direct requests to this host instead, '
+                             'e.g. python -m benchmarks.bank_stub')
+    parser.add_argument('--parallel-sections', action='store_true',
+                        help='scrape each section in its own browser session')
+    parser.add_argument('--firefly-token',
+                        help='defaults to the FIREFLY_TOKEN env variable')
+    parser.add_argument('--firefly-pool-size', type=int, default=10)
+    parser.add_argument('--firefly-retries', type=int, default=5)
+    parser.add_argument('--firefly-backoff', type=float, default=0.5)
+    parser.add_argument('--firefly-page-workers', type=int, default=4)
+    parser.add_argument('--upload-workers', type=int, default=1,
+                        help='days uploaded concurrently, the transactions '
+                             'of one day keep their order')
+    parser.add_argument('--reconcile', action='store_true',
+                        help='check the ledger against firefly this run')
+    parser.add_argument('--reconcile-days', type=int, default=7)
+    parser.add_argument('--metadata-ttl', type=float, default=24.0,
+                        help='hours to trust cached firefly account and '
+                             'currency ids')
+    parser.add_argument('--stocks-net-worth', action='store_true',
+                        help='keep a firefly asset account at the value of '
+                             'the stock portfolio, revalued once a day')
+    parser.add_argument('--stream', action='store_true',
+                        help='upload transactions while still scraping')
+    parser.add_argument('--stream-queue', type=int, default=1000,
+                        help='parsed transactions --stream holds before '
+                             'the scraper has to wait for the upload')
+    parser.add_argument('--resume', action='store_true',
+                        help='only upload what the journal still has pending')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep the browser logged in and refresh on a '
+                             'schedule until terminated')
+    parser.add_argument('--interval', type=float, default=900.0,
+                        help='seconds between --daemon refreshes')
+    parser.add_argument('--jitter', type=float, default=0.2,
+                        help='fraction the interval randomly varies by')
+    parser.add_argument('--metrics-out', metavar='PATH',
+                        help='write run metrics to PATH.json and PATH.prom')
+    parser.add_argument('--profiles', metavar='FILE',
+                        help='json list of credential profiles to run')
+    parser.add_argument('--targets',
+                        help='comma separated grid endpoints for --profiles')
+    parser.add_argument('--per-node', type=int, default=1)
+    parser.add_argument('--login-interval', type=float, default=30.0,
+                        help='minimum seconds between logins to one bank')
+    # credentials come from the environment unless a profile sets them
+    parser.set_defaults(username=None, password=None)
     args = parser.parse_args()
 
-    if args.type == 'mizrahi':
-        result = scrape(
-            args.target,
-            getattr(DesiredCapabilities, args.browser.upper()),
+    if args.profiles:
+        outcomes = run_batch(
+            load_profiles(args.profiles),
+            args.targets.split(',') if args.targets else [args.target],
+            args.per_node,
+            args.login_interval,
+            partial(run_profile, args),
         )
-        if args.firefly:
-            firefly_upload(result, args.firefly)
+        failed = [o.name for o in outcomes if o.status != 'ok']
+        if failed:
+            raise RuntimeError(f'profiles failed: {", ".join(failed)}')
+    else:
+        run(args)
+
+
+def run_profile(args, profile, target):
+    logging.basicConfig()
+    args = copy(args)
+    args.type = profile['type']
+    args.target = target
+    args.state_dir = path.join(args.state_dir, profile['name'])
+    if args.metrics_out:
+        args.metrics_out = f"{args.metrics_out}-{profile['name']}"
+    if args.results:
+        args.results = path.join(path.dirname(args.results),
+                                 f"{profile['name']}-"
+                                 f"{path.basename(args.results)}")
+    args.username = profile_value(profile, 'username')
+    args.password = profile_value(profile, 'password')
+    args.firefly = profile.get('firefly', args.firefly)
+    args.firefly_token = profile_value(profile, 'firefly_token') \
+        or args.firefly_token
+    run(args)
+
+
+def run(args):
+    try:
+        run_pipeline(args)
+    finally:
+        if args.metrics_out:
+            METRICS.write(args.metrics_out)
+
+
+def run_pipeline(args):
+    if args.type == 'mizrahi':
+        if args.daemon:
+            run_daemon(args)
+            return
+        watermarks = load_watermarks(args.state_dir)
+        results = args.results or path.join(args.state_dir, 'results.jsonl')
+        if args.mode == 'scrape':
+            # nothing below needs the browser, so it can be released before
+            # anything is uploaded
+            write_results(results, [scrape_or_replay(args, watermarks)])
+            return
+        journal = Journal(path.join(args.state_dir, 'journal.jsonl'))
+        scraped = []
+        try:
+            journal.compact()
+            if args.resume:
+                pass
+            elif args.mode == 'upload':
+                for result in read_results(results):
+                    journal.record(result)
+                    scraped.append(result)
+            elif args.stream and args.firefly and not args.replay:
+                scraped.append(scrape_streaming(args, journal, watermarks))
+            else:
+                scraped.append(scrape_or_replay(args, watermarks))
+                journal.record(scraped[-1])
+            if args.results and args.mode == 'both':
+                write_results(args.results, scraped)
+            if args.firefly:
+                upload(args, journal, watermarks)
+                if args.stocks_net_worth:
+                    client = firefly_client(args)
+                    try:
+                        push_net_worths(args, scraped, client)
+                    finally:
+                        client.close()
+        finally:
+            journal.close()
+
+
+def run_daemon(args):
+    from scraper.mizrahi import ScrapeSession
+
+    watermarks = load_watermarks(args.state_dir)
+    journal = Journal(path.join(args.state_dir, 'journal.jsonl'))
+    ledger = Ledger(path.join(args.state_dir, 'ledger.sqlite3'))
+    client = firefly_client(args) if args.firefly else None
+    session = ScrapeSession(args.target, capabilities(args))
+
+    def refresh():
+        with METRICS.stage('refresh'):
+            journal.compact()
+            try:
+                result = session.scrape(scrape_options(args, watermarks),
+                                        logout=False)
+            except Exception:
+                # the next refresh starts over with a new browser
+                session.quit()
+                raise
+            # only the first refresh of a --full-resync ignores watermarks
+            args.full_resync = False
+            store_stocks(args, result)
+            journal.record(result)
+            if client is not None and journal.pending:
+                upload_pending(args, journal, watermarks, client, ledger)
+            if client is not None and args.stocks_net_worth:
+                push_net_worths(args, [result], client)
+        if args.metrics_out:
+            METRICS.write(args.metrics_out)
+
+    try:
+        run_forever(refresh, args.interval, args.jitter)
+    finally:
+        session.logout()
+        session.quit()
+        if client is not None:
+            client.close()
+        ledger.close()
+        journal.close()
+
+
+def capabilities(args) -> dict:
+    # selenium is only imported by runs that scrape, --mode upload never
+    # loads it
+    from selenium.webdriver.remote.remote_connection import LOGGER
+    from scraper.browser import browser_capabilities
+
+    LOGGER.setLevel(logging.INFO)
+    return browser_capabilities(args.browser, args.browser_profile,
+                                headless=not args.headed)
+
+
+def scrape_options(args, watermarks, sink=None) -> ScrapeOptions:
+    from scraper.browser import profile_window_size
+
+    return ScrapeOptions(
+        record_dir=args.record,
+        session_file=path.join(args.state_dir, 'session.json')
+        if args.keep_session else None,
+        parallel_sections=args.parallel_sections,
+        state_dir=args.state_dir,
+        direct=args.direct,
+        direct_base_url=args.direct_base_url,
+        watermarks={} if args.full_resync else watermarks,
+        overlap_days=args.overlap_days,
+        window_size=profile_window_size(args.browser_profile),
+        username=args.username,
+        password=args.password,
+        sink=sink,
+    )
+
+
+def scrape_or_replay(args, watermarks, sink=None):
+    from scraper.mizrahi import scrape, replay
+
+    if args.replay:
+        return replay(args.replay)
+    result = scrape(args.target, capabilities(args),
+                    scrape_options(args, watermarks, sink))
+    store_stocks(args, result)
+    return result
+
+
+def store_stocks(args, result):
+    if result.stocks:
+        StockStore(path.join(args.state_dir, 'stocks')).append(result.stocks)
+
+
+def push_net_worths(args, results, client):
+    metadata = metadata_cache(args)
+    for result in results:
+        if result.stocks:
+            push_net_worth(result, portfolio_value(result.stocks), client,
+                           metadata)
+
+
+def scrape_streaming(args, journal, watermarks):
+    # the stream journals and uploads each batch as it is parsed, what
+    # fails stays pending in the journal for upload() to retry
+    client = firefly_client(args)
+    ledger = Ledger(path.join(args.state_dir, 'ledger.sqlite3'))
+    try:
+        with UploadStream(client, upload_options(args, ledger, journal),
+                          maxsize=args.stream_queue) as stream:
+            result = scrape_or_replay(args, watermarks, stream.put)
+        advance_watermarks(watermarks, result, stream.result_failures(result))
+    finally:
+        ledger.close()
+        client.close()
+    return result
+
+
+def firefly_client(args):
+    return FireflyClient(
+        args.firefly,
+        token=args.firefly_token,
+        pool_size=max(args.firefly_pool_size, args.upload_workers,
+                      args.firefly_page_workers),
+        retries=args.firefly_retries,
+        backoff_factor=args.firefly_backoff,
+        page_workers=args.firefly_page_workers,
+    )
+
+
+def upload_options(args, ledger, journal):
+    return UploadOptions(
+        workers=args.upload_workers,
+        ledger=ledger,
+        journal=journal,
+        reconcile_interval=timedelta(days=args.reconcile_days),
+        force_reconcile=args.reconcile,
+        metadata=metadata_cache(args),
+    )
+
+
+def metadata_cache(args):
+    return MetadataCache(
+        path.join(args.state_dir, 'firefly_metadata.json'),
+        timedelta(hours=args.metadata_ttl),
+    )
+
+
+def upload(args, journal, watermarks):
+    client = firefly_client(args)
+    ledger = Ledger(path.join(args.state_dir, 'ledger.sqlite3'))
+    try:
+        upload_pending(args, journal, watermarks, client, ledger)
+    finally:
+        ledger.close()
+        client.close()
+
+
+def upload_pending(args, journal, watermarks, client, ledger):
+    failed = 0
+    options = upload_options(args, ledger, journal)
+    try:
+        for result in journal.pending_results():
+            failures = firefly_upload(result, client, options)
+            advance_watermarks(watermarks, result, failures)
+            failed += sum(map(len, failures.values()))
+    finally:
+        save_watermarks(args.state_dir, watermarks)
+    if failed:
+        raise RuntimeError(f'{failed} transactions failed to upload')
 
 
 if __name__ == '__main__':
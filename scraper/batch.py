@@ -0,0 +1,122 @@
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import get_context
+from os import environ
+from queue import Queue
+from threading import Lock
+from time import monotonic, sleep
+from typing import Callable, Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class ProfileOutcome:
+    name: str
+    target: str = ''
+    status: str = 'pending'
+    duration: float = 0.0
+    error: str = ''
+
+
+def profile_value(profile: dict, key: str) -> Optional[str]:
+    # secrets are given either inline or as the name of an env variable
+    if profile.get(key):
+        return profile[key]
+    if profile.get(f'{key}_env'):
+        return environ.get(profile[f'{key}_env'])
+    return None
+
+
+def load_profiles(filename: str) -> List[dict]:
+    with open(filename, encoding='utf-8') as f:
+        profiles = json.load(f)
+    names = set()
+    for profile in profiles:
+        assert profile.get('name'), 'every profile needs a name'
+        assert profile['name'] not in names, \
+            f"duplicate profile name {profile['name']}"
+        names.add(profile['name'])
+        profile.setdefault('type', 'mizrahi')
+        # an unresolved credential would fall back to the default account
+        # from the environment and scrape it into this profile's state
+        for key in ('username', 'password', 'firefly_token'):
+            if key == 'firefly_token' and not profile.get(f'{key}_env'):
+                continue
+            assert profile_value(profile, key), \
+                f"profile {profile['name']} has no {key}"
+    return profiles
+
+
+class RateLimiter:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.lock = Lock()
+        self.next_slot: Dict[str, float] = {}
+
+    def wait(self, key: str):
+        with self.lock:
+            now = monotonic()
+            start = max(now, self.next_slot.get(key, now))
+            self.next_slot[key] = start + self.interval
+        if start > now:
+            log.debug(f"rate limiting {key} for {start - now:.1f}s")
+            sleep(start - now)
+
+
+def run_batch(profiles: List[dict], targets: List[str], per_node: int,
+              login_interval: float,
+              run_profile: Callable[[dict, str], None]) \
+        -> List[ProfileOutcome]:
+    # each profile runs in its own process for isolation, the threads here
+    # only hold grid node slots and pace the logins per bank
+    slots = Queue()
+    for _ in range(per_node):
+        for target in targets:
+            slots.put(target)
+    workers = per_node * len(targets)
+    limiter = RateLimiter(login_interval)
+    outcomes = [ProfileOutcome(profile['name']) for profile in profiles]
+
+    def schedule(profile, outcome):
+        target = slots.get()
+        try:
+            limiter.wait(profile['type'])
+            outcome.target = target
+            started = monotonic()
+            log.info(f"starting profile {profile['name']} on {target}")
+            try:
+                # a fresh process per profile, a reused worker would carry
+                # the metrics and locator cache of the profiles it ran before
+                with ProcessPoolExecutor(
+                        max_workers=1, mp_context=get_context('spawn'),
+                ) as process:
+                    process.submit(run_profile, profile, target).result()
+                outcome.status = 'ok'
+            except Exception as e:
+                outcome.status = 'failed'
+                outcome.error = f'{type(e).__name__}: {e}'
+                log.error(f"profile {profile['name']} failed: {e}")
+            outcome.duration = monotonic() - started
+        finally:
+            slots.put(target)
+
+    with ThreadPoolExecutor(max_workers=workers) as threads:
+        for future in [
+            threads.submit(schedule, profile, outcome)
+            for profile, outcome in zip(profiles, outcomes)
+        ]:
+            future.result()
+    log_summary(outcomes)
+    return outcomes
+
+
+def log_summary(outcomes: List[ProfileOutcome]):
+    # warning so it shows at the default level main() configures
+    width = max([len(o.name) for o in outcomes] + [7])
+    log.warning(f"{'profile':<{width}}  {'status':<7}  {'seconds':>8}  target")
+    for o in outcomes:
+        log.warning(f"{o.name:<{width}}  {o.status:<7}  {o.duration:>8.1f}  "
+                 f"{o.target}{'  ' + o.error if o.error else ''}")
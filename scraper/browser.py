@@ -0,0 +1,152 @@
+import logging
+from copy import deepcopy
+from typing import Optional, Tuple
+
+from selenium.webdriver import DesiredCapabilities
+
+log = logging.getLogger(__name__)
+
+PROFILES = ('default', 'lean')
+# large enough that the bank still serves its desktop layout
+LEAN_WINDOW = (1366, 768)
+# analytics, ads, social widgets and video hosts the marketing pages pull
+# in, none of them is needed to log in or to read the account pages
+BLOCKED_HOSTS = (
+    'google-analytics.com',
+    'googletagmanager.com',
+    'googleadservices.com',
+    'googlesyndication.com',
+    'doubleclick.net',
+    'facebook.net',
+    'facebook.com',
+    'hotjar.com',
+    'clarity.ms',
+    'bing.com',
+    'linkedin.com',
+    'licdn.com',
+    'tiktok.com',
+    'taboola.com',
+    'outbrain.com',
+    'youtube.com',
+    'ytimg.com',
+    'vimeo.com',
+    'vimeocdn.com',
+)
+# network.dns.localDomains only matches whole host names, so firefox gets
+# the subdomains the scripts are actually served from. best effort, hosts
+# missing here still load under firefox
+FIREFOX_BLOCKED_HOSTS = BLOCKED_HOSTS + (
+    'www.google-analytics.com',
+    'ssl.google-analytics.com',
+    'region1.google-analytics.com',
+    'analytics.google.com',
+    'www.googletagmanager.com',
+    'www.googleadservices.com',
+    'pagead2.googlesyndication.com',
+    'tpc.googlesyndication.com',
+    'stats.g.doubleclick.net',
+    'googleads.g.doubleclick.net',
+    'ad.doubleclick.net',
+    'static.doubleclick.net',
+    'connect.facebook.net',
+    'www.facebook.com',
+    'static.hotjar.com',
+    'script.hotjar.com',
+    'vars.hotjar.com',
+    'in.hotjar.com',
+    'www.clarity.ms',
+    'c.clarity.ms',
+    'bat.bing.com',
+    'c.bing.com',
+    'snap.licdn.com',
+    'px.ads.linkedin.com',
+    'analytics.tiktok.com',
+    'cdn.taboola.com',
+    'trc.taboola.com',
+    'widgets.outbrain.com',
+    'amplify.outbrain.com',
+    'www.youtube.com',
+    'i.ytimg.com',
+    's.ytimg.com',
+    'player.vimeo.com',
+    'f.vimeocdn.com',
+    'i.vimeocdn.com',
+)
+CHROMIUM_OPTIONS = {
+    'chrome': 'goog:chromeOptions',
+    'microsoftedge': 'ms:edgeOptions',
+}
+
+
+def browser_capabilities(browser: str, profile: str = 'default',
+                         headless: bool = True) -> dict:
+    capabilities = deepcopy(getattr(DesiredCapabilities, browser.upper()))
+    if profile == 'default':
+        return capabilities
+    if profile != 'lean':
+        raise ValueError(f'unknown browser profile {profile}')
+    name = capabilities.get('browserName', browser).lower()
+    # eager returns once the DOM is parsed, every page is waited on
+    # explicitly afterwards anyway
+    capabilities['pageLoadStrategy'] = 'eager'
+    if name in CHROMIUM_OPTIONS:
+        options = capabilities.setdefault(CHROMIUM_OPTIONS[name], {})
+        options.setdefault('args', []).extend(chromium_args(headless))
+        options.setdefault('prefs', {}).update({
+            'profile.managed_default_content_settings.images': 2,
+            'profile.default_content_setting_values.notifications': 2,
+        })
+    elif name == 'firefox':
+        options = capabilities.setdefault('moz:firefoxOptions', {})
+        if headless:
+            options.setdefault('args', []).append('-headless')
+        options.setdefault('prefs', {}).update(firefox_prefs())
+    else:
+        log.warning(f'no lean settings for {name}, only eager page loading')
+    return capabilities
+
+
+def chromium_args(headless: bool) -> list:
+    rules = ', '.join(
+        f'MAP {pattern} ~NOTFOUND'
+        for host in BLOCKED_HOSTS for pattern in (host, f'*.{host}')
+    )
+    args = [
+        f'--host-resolver-rules={rules}',
+        '--blink-settings=imagesEnabled=false',
+        '--autoplay-policy=user-gesture-required',
+        '--mute-audio',
+        '--disable-extensions',
+        '--disable-background-networking',
+        '--disable-component-update',
+        '--disable-default-apps',
+        '--disable-sync',
+        '--no-first-run',
+        '--disable-dev-shm-usage',
+        '--window-size={},{}'.format(*LEAN_WINDOW),
+    ]
+    if headless:
+        args.append('--headless=new')
+    return args
+
+
+def firefox_prefs() -> dict:
+    return {
+        'permissions.default.image': 2,
+        'media.autoplay.default': 5,
+        'media.autoplay.blocking_policy': 2,
+        'gfx.downloadable_fonts.enabled': False,
+        'browser.cache.disk.enable': False,
+        'dom.webnotifications.enabled': False,
+        'app.update.enabled': False,
+        'extensions.update.enabled': False,
+        'browser.safebrowsing.malware.enabled': False,
+        'browser.safebrowsing.phishing.enabled': False,
+        # firefox has no host blocklist, the listed hosts resolve to
+        # 127.0.0.1 and the requests go to loopback instead
+        'network.dns.localDomains': ','.join(FIREFOX_BLOCKED_HOSTS),
+    }
+
+
+def profile_window_size(profile: str) -> Optional[Tuple[int, int]]:
+    return LEAN_WINDOW if profile == 'lean' else None
@@ -1,25 +1,81 @@
 import re
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from hashlib import sha256
-from typing import Optional
-
-from dataclasses import dataclass
-
-from selenium.webdriver import Keys
-from selenium.webdriver.support import expected_conditions
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.remote.webdriver import WebDriver
-
-
-@dataclass
-class ScrapeResults:
-    bank = ''
-    account = ''
-    nis = 0.0
-    usd = 0.0
-    eur = 0.0
-    stocks = []
-    transactions = {
+from typing import Callable, Optional, Dict, List, Tuple
+
+from dataclasses import dataclass, field
+
+
+class Transaction:
+    __slots__ = ('date', 'value_date', 'description', 'serial', 'value',
+                 'balance', '_id_key', '_id')
+
+    def __init__(self, t_date: Optional[date], value_date: Optional[date],
+                 description: str, serial: str, value: Optional[float],
+                 balance: Optional[float]):
+        set_field = object.__setattr__
+        set_field(self, 'date', t_date)
+        set_field(self, 'value_date', value_date)
+        set_field(self, 'description', description)
+        set_field(self, 'serial', serial)
+        set_field(self, 'value', value)
+        set_field(self, 'balance', balance)
+        set_field(self, '_id_key', None)
+        set_field(self, '_id', None)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __eq__(self, other):
+        return isinstance(other, Transaction) and astuple(self) == astuple(
+            other)
+
+    def __hash__(self):
+        return hash(astuple(self))
+
+    def __repr__(self):
+        return f'Transaction{astuple(self)!r}'
+
+    def transaction_id(self, currency: str, account: str) -> str:
+        # the hash only changes with the account it is filed under, which is
+        # the same for every lookup within a run
+        if self._id_key != (currency, account):
+            object.__setattr__(
+                self, '_id', id_for_transaction(self, currency, account)
+            )
+            object.__setattr__(self, '_id_key', (currency, account))
+        return self._id
+
+    def to_dict(self) -> dict:
+        return {
+            'date': self.date.isoformat() if self.date else None,
+            'value_date':
+                self.value_date.isoformat() if self.value_date else None,
+            'description': self.description,
+            'serial': self.serial,
+            'value': self.value,
+            'balance': self.balance,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Transaction':
+        return cls(
+            date.fromisoformat(data['date']) if data.get('date') else None,
+            date.fromisoformat(data['value_date'])
+            if data.get('value_date') else None,
+            data['description'],
+            data['serial'],
+            data['value'],
+            data['balance'],
+        )
+
+
+def astuple(t: Transaction) -> tuple:
+    return t.date, t.value_date, t.description, t.serial, t.value, t.balance
+
+
+def new_transactions() -> Dict[str, List[Transaction]]:
+    return {
         'nis': [],
         'usd': [],
         'eur': [],
@@ -27,28 +83,51 @@ class ScrapeResults:
 
 
 @dataclass
-class ScrapeStock:
-    symbol = ''
-    owned = 0
-    buying_total = 0
-    selling_total = 0
-    buying = {}
-    selling = {}
+class ScrapeResults:
+    bank: str = ''
+    account: str = ''
+    nis: float = 0.0
+    usd: float = 0.0
+    eur: float = 0.0
+    stocks: List[dict] = field(default_factory=list)
+    transactions: Dict[str, List[Transaction]] = field(
+        default_factory=new_transactions
+    )
 
 
-def find_element_by_text(driver: WebDriver, by, value, text, exact=True):
-    for element in driver.find_elements(by=by, value=value):
-        if (exact and element.text == text) \
-                or (not exact and text in element.text):
-            return element
+@dataclass
+class ScrapeOptions:
+    record_dir: Optional[str] = None
+    session_file: Optional[str] = None
+    parallel_sections: bool = False
+    username: Optional[str] = None
+    password: Optional[str] = None
+    state_dir: Optional[str] = None
+    direct: bool = False
+    direct_base_url: Optional[str] = None
+    watermarks: Dict[str, date] = field(default_factory=dict)
+    overlap_days: int = 7
+    # a fixed (width, height) instead of maximizing the window
+    window_size: Optional[Tuple[int, int]] = None
+    # called with (result, currency, entries) as each batch is parsed
+    sink: Optional[Callable[[ScrapeResults, str, List[Transaction]],
+                            None]] = None
+
+    def since(self, account_number: str) -> Optional[date]:
+        watermark = self.watermarks.get(account_number)
+        if watermark is None:
+            return None
+        return watermark - timedelta(days=self.overlap_days)
 
 
-def safe_click(driver: WebDriver, element, timeout=10):
-    element = WebDriverWait(driver, timeout).until(
-        expected_conditions.element_to_be_clickable(element)
-    )
-    driver.execute_script('arguments[0].scrollIntoView(true)', element)
-    element.send_keys(Keys.RETURN)
+@dataclass
+class ScrapeStock:
+    symbol: str = ''
+    owned: int = 0
+    buying_total: int = 0
+    selling_total: int = 0
+    buying: dict = field(default_factory=dict)
+    selling: dict = field(default_factory=dict)
 
 
 def clean_float(text: str) -> Optional[float]:
@@ -60,17 +139,18 @@ def date_parse(text: str) -> Optional[date]:
     return datetime.strptime(text, "%d/%m/%y").date() if text else None
 
 
-def id_for_transaction(entry: dict, currency: str, account: str) -> str:
-    date_use = entry['date'] if entry.get('date') else entry['value_date']
+def id_for_transaction(entry: Transaction, currency: str, account: str) \
+        -> str:
+    date_use = entry.date if entry.date else entry.value_date
     m = sha256()
     m.update(date_use.strftime("%Y-%m-%d-").encode('utf-8'))
-    m.update(entry['serial'].encode('utf-8'))
+    m.update(entry.serial.encode('utf-8'))
     m.update(b'-')
     m.update(currency.lower().encode('utf-8'))
     m.update(b'-')
     m.update(account.encode('utf-8'))
     m.update(b'-')
-    m.update(str(entry['value']).encode('utf-8'))
+    m.update(str(entry.value).encode('utf-8'))
     m.update(b'-')
-    m.update(str(entry['balance']).encode('utf-8'))
+    m.update(str(entry.balance).encode('utf-8'))
     return m.hexdigest()
@@ -0,0 +1,41 @@
+import logging
+import random
+from signal import SIGTERM, signal
+from threading import Event
+from time import monotonic
+from typing import Callable, Optional
+
+log = logging.getLogger(__name__)
+
+# consecutive failures stretch the delay up to this many intervals, so a
+# broken login does not retry against the bank every cycle
+MAX_BACKOFF = 8
+
+
+def next_delay(interval: float, jitter: float, failures: int = 0) -> float:
+    # spread around the interval so refreshes never line up with the clock
+    delay = interval * random.uniform(1 - jitter, 1 + jitter)
+    return delay * min(2 ** failures, MAX_BACKOFF)
+
+
+def run_forever(refresh: Callable[[], None], interval: float,
+                jitter: float = 0.2, stop: Optional[Event] = None):
+    stop = stop or Event()
+    signal(SIGTERM, lambda *_: stop.set())
+    failures = 0
+    cycle = 0
+    while not stop.is_set():
+        cycle += 1
+        started = monotonic()
+        try:
+            refresh()
+            failures = 0
+        except Exception:
+            failures += 1
+            log.exception(f'refresh {cycle} failed ({failures} in a row)')
+        elapsed = monotonic() - started
+        # intervals run start to start, a slow refresh eats into the wait
+        delay = max(0.0, next_delay(interval, jitter, failures) - elapsed)
+        log.info(f'refresh {cycle} took {elapsed:.1f}s, next in {delay:.0f}s')
+        stop.wait(delay)
+    log.info('stopping after a termination signal')
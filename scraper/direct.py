@@ -0,0 +1,365 @@
+import json
+import logging
+import re
+from datetime import date, datetime, timedelta
+from os import path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from scraper.common import clean_float, date_parse
+from scraper.metrics import instrument_session
+from scraper.snapshots import save_snapshot
+from scraper.state import write_json_atomic
+
+log = logging.getLogger(__name__)
+
+ENDPOINTS = 'direct_endpoints.json'
+NIS_RESPONSE = 'nis_response.json'
+NIS_REQUIRED = {'תאריך', 'יתרה בש"ח', 'זכות/חובה', 'אסמכתה', 'סוג תנועה'}
+
+# keeps a copy of every XHR/fetch issued from now on, so the request the
+# grid used to load its rows can be replayed without the UI
+CAPTURE_SCRIPT = """
+if (window.__capturedRequests) return;
+const captured = window.__capturedRequests = [];
+const open = XMLHttpRequest.prototype.open;
+const send = XMLHttpRequest.prototype.send;
+const setHeader = XMLHttpRequest.prototype.setRequestHeader;
+XMLHttpRequest.prototype.open = function (method, url) {
+    this.__capture = {method: method, url: new URL(url, location.href).href,
+                      headers: {}};
+    return open.apply(this, arguments);
+};
+XMLHttpRequest.prototype.setRequestHeader = function (name, value) {
+    if (this.__capture) this.__capture.headers[name] = value;
+    return setHeader.apply(this, arguments);
+};
+XMLHttpRequest.prototype.send = function (body) {
+    const request = this.__capture;
+    if (request) {
+        request.body = typeof body === 'string' ? body : null;
+        this.addEventListener('load', () => {
+            try {
+                request.response = this.responseText;
+                captured.push(request);
+            } catch (e) {}
+        });
+    }
+    return send.apply(this, arguments);
+};
+if (window.fetch) {
+    const fetch = window.fetch;
+    window.fetch = function (input, init) {
+        init = init || {};
+        const request = {
+            method: (init.method || 'GET').toUpperCase(),
+            url: new URL(typeof input === 'string' ? input : input.url,
+                         location.href).href,
+            headers: Object.assign({}, init.headers || {}),
+            body: typeof init.body === 'string' ? init.body : null,
+        };
+        return fetch.apply(this, arguments).then(response => {
+            response.clone().text().then(text => {
+                request.response = text;
+                captured.push(request);
+            }).catch(() => {});
+            return response;
+        });
+    };
+}
+"""
+CAPTURED_SCRIPT = "return window.__capturedRequests || [];"
+# headers that describe the payload rather than the browser or the session
+REPLAY_HEADERS = ('content-type', 'accept', 'x-requested-with')
+DATE_PATTERNS = (
+    (re.compile(r'\b(\d{4})-(\d{2})-(\d{2})'), '%Y-%m-%d'),
+    (re.compile(r'\b(\d{2})/(\d{2})/(\d{4})'), '%d/%m/%Y'),
+)
+# the page size a server paged grid sends along, kendo posts take/pageSize
+PAGE_SIZE = re.compile(
+    r'\b(?:take|pagesize|page_size|limit|rows|top)["\']?\s*[=:]\s*["\']?(\d+)',
+    re.IGNORECASE,
+)
+# what a paged request is rewritten to ask for, a year of transactions
+# stays far below it and a reply that fills it falls back to the browser
+UNPAGED_SIZE = 10000
+# the row count a paged reply reports next to the rows it carries
+TOTAL_KEYS = ('total', 'totalcount', 'total_count', 'recordstotal', 'count')
+
+
+def install_capture(driver):
+    driver.execute_script(CAPTURE_SCRIPT)
+
+
+def find_records(data) -> List[dict]:
+    # the largest list of objects anywhere in the response holds the rows
+    best = []
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            if len(node) > len(best) and node \
+                    and all(isinstance(i, dict) for i in node):
+                best = node
+            stack.extend(node)
+        elif isinstance(node, dict):
+            stack.extend(node.values())
+    return best
+
+
+def value_text(value) -> str:
+    # renders a json value the way the grid shows it to parse_nis_row
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        for pattern, fmt in DATE_PATTERNS:
+            match = pattern.match(value)
+            if match and value[match.end():][:1] in ('', 'T', ' '):
+                try:
+                    parsed = datetime.strptime(match.group(0), fmt)
+                except ValueError:
+                    break
+                return parsed.strftime('%d/%m/%y')
+        return value
+    return str(value)
+
+
+def same_value(cell: str, value) -> bool:
+    text = value_text(value)
+    if cell.strip() == text.strip():
+        return True
+    try:
+        if date_parse(cell.strip()) and date_parse(cell.strip()) \
+                == date_parse(text.strip()):
+            return True
+    except ValueError:
+        pass
+    number = clean_float(cell)
+    return number is not None and isinstance(value, (int, float)) \
+        and abs(number - value) < 0.005
+
+
+def learn_columns(rows: List[list], records: List[dict]) \
+        -> Optional[Dict[str, str]]:
+    # maps each grid column name to the record field that rendered it, the
+    # first rows on screen are the first records of the response
+    columns = {}
+    sample = list(zip(rows, records))[:10]
+    if not sample:
+        return None
+    for index, (name, _) in enumerate(sample[0][0]):
+        if not name:
+            continue
+        for field in sample[0][1]:
+            if all(
+                index < len(row) and same_value(row[index][1],
+                                                record.get(field))
+                for row, record in sample
+            ):
+                columns[name] = field
+                break
+    return columns
+
+
+def learn_nis_endpoint(driver, rows: List[list], state_dir: str,
+                       paged=False) -> bool:
+    # rows is the first grid page, paged tells whether the grid had more
+    names = {name for name, _ in rows[0]} if rows else set()
+    for request in reversed(driver.execute_script(CAPTURED_SCRIPT)):
+        try:
+            records = find_records(json.loads(request.get('response') or ''))
+        except ValueError:
+            continue
+        if len(records) < len(rows):
+            continue
+        columns = learn_columns(rows, records)
+        if not columns or not NIS_REQUIRED <= set(columns) <= names:
+            continue
+        if paged and len(records) == len(rows):
+            # the reply held only the first of several pages, ask for all
+            # of them at once instead
+            request = unpage(request)
+            if request is None:
+                log.warning("the nis grid is paged on the server with no "
+                            "page size to raise, not using direct mode")
+                return False
+        spec = {
+            'method': request['method'],
+            'url': request['url'],
+            'headers': {
+                k: v for k, v in request.get('headers', {}).items()
+                if k.lower() in REPLAY_HEADERS
+            },
+            'body': request.get('body'),
+            'columns': columns,
+            'recorded_on': date.today().isoformat(),
+        }
+        endpoints = load_endpoints(state_dir)
+        endpoints['nis'] = spec
+        write_json_atomic(path.join(state_dir, ENDPOINTS), endpoints)
+        log.info(f"learned direct nis endpoint {spec['url']}")
+        return True
+    log.warning("no captured request matched the nis grid, direct mode "
+                "keeps using the browser")
+    return False
+
+
+def load_endpoints(state_dir: str) -> dict:
+    filename = path.join(state_dir, ENDPOINTS)
+    if not path.exists(filename):
+        return {}
+    with open(filename, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def shift_dates(text: Optional[str], days: int) -> Optional[str]:
+    # the recorded body asks for a range relative to the day it was
+    # recorded on, move it so it asks for the same range relative to today
+    if not text or not days:
+        return text
+    for pattern, fmt in DATE_PATTERNS:
+        def shift(match, fmt=fmt):
+            try:
+                moved = datetime.strptime(match.group(0), fmt) \
+                        + timedelta(days=days)
+            except ValueError:
+                return match.group(0)
+            return moved.strftime(fmt)
+        text = pattern.sub(shift, text)
+    return text
+
+
+def shift_url_dates(url: str, days: int) -> str:
+    # a GET grid carries its range in the query string, percent encoded
+    if not days:
+        return url
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    shifted = [(k, shift_dates(v, days)) for k, v in query]
+    return urlunsplit((
+        parts.scheme, parts.netloc, shift_dates(parts.path, days),
+        urlencode(shifted) if shifted != query else parts.query,
+        parts.fragment,
+    ))
+
+
+def unpage(request: dict) -> Optional[dict]:
+    # raises every page size parameter of a captured request
+    parts = urlsplit(request['url'])
+    body = request.get('body') or ''
+    found = PAGE_SIZE.search(parts.query) or PAGE_SIZE.search(body)
+    if not found:
+        return None
+
+    def raise_size(text: str) -> str:
+        return PAGE_SIZE.sub(
+            lambda m: m.group(0)[:m.start(1) - m.start(0)]
+            + str(UNPAGED_SIZE), text,
+        )
+    return {
+        **request,
+        'url': urlunsplit(parts._replace(query=raise_size(parts.query))),
+        'body': raise_size(body) if body else request.get('body'),
+    }
+
+
+def request_page_size(spec: dict) -> Optional[int]:
+    match = PAGE_SIZE.search(urlsplit(spec['url']).query) \
+        or PAGE_SIZE.search(spec.get('body') or '')
+    return int(match.group(1)) if match else None
+
+
+def reported_total(data) -> Optional[int]:
+    # only the outer levels, a row may well have a field called count
+    if not isinstance(data, dict):
+        return None
+    nodes = [data] + [v for v in data.values() if isinstance(v, dict)]
+    for node in nodes:
+        for key, value in node.items():
+            if key.lower() in TOTAL_KEYS and isinstance(value, int) \
+                    and not isinstance(value, bool):
+                return value
+    return None
+
+
+def check_records(spec: dict, data, records: List[dict]):
+    # a reply that is not the grid data has to fail, an empty list would
+    # otherwise pass for an account without transactions
+    if not records:
+        raise ValueError('the direct reply holds no records')
+    missing = {spec['columns'][name] for name in NIS_REQUIRED} \
+        - set(records[0])
+    if missing:
+        raise ValueError(f'the direct reply lacks {sorted(missing)}')
+    total = reported_total(data)
+    if total is not None and total > len(records):
+        raise ValueError(f'the direct reply holds {len(records)} of {total} '
+                         f'records')
+    page_size = request_page_size(spec)
+    if page_size and len(records) >= page_size:
+        raise ValueError(f'the direct reply filled a page of {page_size} '
+                         f'records, more may follow')
+
+
+class DirectClient:
+    def __init__(self, cookies: List[dict], user_agent: str = '',
+                 base_url: Optional[str] = None, pool_size=4, timeout=60):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.session = instrument_session(requests.Session(), 'bank')
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if user_agent:
+            self.session.headers['User-Agent'] = user_agent
+        for cookie in cookies:
+            self.session.cookies.set(
+                cookie['name'], cookie['value'],
+                domain=cookie.get('domain', ''), path=cookie.get('path', '/'),
+            )
+
+    @classmethod
+    def from_driver(cls, driver, base_url: Optional[str] = None):
+        return cls(
+            driver.get_cookies(),
+            driver.execute_script('return navigator.userAgent'),
+            base_url,
+        )
+
+    def url(self, url: str) -> str:
+        # lets tests point a recorded endpoint at a local stub server
+        if not self.base_url:
+            return url
+        base = urlsplit(self.base_url)
+        parts = urlsplit(url)
+        return urlunsplit((base.scheme, base.netloc, parts.path, parts.query,
+                           parts.fragment))
+
+    def fetch_rows(self, spec: dict,
+                   record_dir: Optional[str] = None) -> List[list]:
+        days = (date.today() - date.fromisoformat(spec['recorded_on'])).days
+        r = self.session.request(
+            spec['method'],
+            self.url(shift_url_dates(spec['url'], days)),
+            headers=spec.get('headers'),
+            data=shift_dates(spec.get('body'), days),
+            timeout=self.timeout,
+        )
+        r.raise_for_status()
+        data = r.json()
+        if record_dir:
+            save_snapshot(record_dir, NIS_RESPONSE, data)
+        records = find_records(data)
+        check_records(spec, data, records)
+        return [
+            [[name, value_text(record.get(field))]
+             for name, field in spec['columns'].items()]
+            for record in records
+        ]
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,166 @@
+import re
+from html.parser import HTMLParser
+from typing import Iterator, List, Optional
+
+VOID_TAGS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'source', 'track', 'wbr',
+}
+SKIP_TAGS = {'script', 'style', 'noscript', 'template', 'head'}
+BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'caption', 'dd', 'div',
+    'dl', 'dt', 'fieldset', 'figure', 'footer', 'form', 'h1', 'h2', 'h3',
+    'h4', 'h5', 'h6', 'header', 'li', 'main', 'nav', 'ol', 'section',
+    'table', 'tbody', 'tfoot', 'thead', 'tr', 'ul',
+}
+# opening one of these implicitly closes the listed open elements
+IMPLICIT_CLOSE = {
+    'tr': {'tr', 'td', 'th'},
+    'td': {'td', 'th'},
+    'th': {'td', 'th'},
+    'li': {'li'},
+    'p': {'p'},
+}
+WHITESPACE = re.compile(r'\s+')
+DISPLAY_NONE = re.compile(r'(?:^|;)\s*display\s*:\s*none\b', re.IGNORECASE)
+
+
+class Node:
+    __slots__ = ('tag', 'attrs', 'children', 'parent')
+
+    def __init__(self, tag: str, attrs: dict, parent: Optional['Node']):
+        self.tag = tag
+        self.attrs = attrs
+        self.children = []
+        self.parent = parent
+
+    @property
+    def id(self) -> str:
+        return self.attrs.get('id') or ''
+
+    @property
+    def classes(self) -> List[str]:
+        return (self.attrs.get('class') or '').split()
+
+    @property
+    def hidden(self) -> bool:
+        # what a page can hide without css files, kendo hides columns with
+        # an inline display:none
+        return 'hidden' in self.attrs \
+            or bool(DISPLAY_NONE.search(self.attrs.get('style') or ''))
+
+    @property
+    def cells(self) -> List['Node']:
+        # the rendered cells, a hidden column is not part of the row
+        return [
+            c for c in self.elements()
+            if c.tag in ('td', 'th') and not c.hidden
+        ]
+
+    def elements(self) -> Iterator['Node']:
+        for child in self.children:
+            if isinstance(child, Node):
+                yield child
+
+    def iter(self, tag: str = None, cls: str = None) -> Iterator['Node']:
+        for child in self.elements():
+            if (tag is None or child.tag == tag) \
+                    and (cls is None or cls in child.classes):
+                yield child
+            yield from child.iter(tag, cls)
+
+    def get_element_by_id(self, element_id: str) -> Optional['Node']:
+        for node in self.iter():
+            if node.id == element_id:
+                return node
+        return None
+
+    def text_content(self) -> str:
+        return ''.join(
+            child.text_content() if isinstance(child, Node) else child
+            for child in self.children
+        )
+
+    def inner_text(self) -> str:
+        # approximates the rendered innerText, block boundaries become
+        # newlines and table cells are separated with tabs
+        parts = []
+        self._inner_text(parts)
+        text = ''
+        pending = 0
+        for part in parts:
+            if isinstance(part, int):
+                pending = max(pending, part)
+                continue
+            if not part:
+                continue
+            if text and pending:
+                text = text.rstrip(' ') + '\n' * pending
+                part = part.lstrip(' ')
+            elif not text or text.endswith(('\n', '\t')):
+                part = part.lstrip(' ')
+            pending = 0
+            text += part
+        return text.strip(' \n')
+
+    def _inner_text(self, parts: list):
+        for child in self.children:
+            if not isinstance(child, Node):
+                parts.append(WHITESPACE.sub(' ', child))
+            elif child.tag == 'br':
+                parts.append('\n')
+            elif child.tag in SKIP_TAGS or child.hidden:
+                continue
+            elif child.tag in ('td', 'th'):
+                child._inner_text(parts)
+                if child is not child.parent.cells[-1]:
+                    parts.append('\t')
+            elif child.tag == 'p':
+                parts.append(2)
+                child._inner_text(parts)
+                parts.append(2)
+            elif child.tag in BLOCK_TAGS:
+                parts.append(1)
+                child._inner_text(parts)
+                parts.append(1)
+            else:
+                child._inner_text(parts)
+
+
+class _TreeBuilder(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = Node('#document', {}, None)
+        self.stack = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        closes = IMPLICIT_CLOSE.get(tag)
+        if closes:
+            while self.stack[-1].tag in closes:
+                self.stack.pop()
+        parent = self.stack[-1]
+        node = Node(tag, {k: v or '' for k, v in attrs}, parent)
+        parent.children.append(node)
+        if tag not in VOID_TAGS:
+            self.stack.append(node)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.stack.pop()
+
+    def handle_endtag(self, tag):
+        for depth in range(len(self.stack) - 1, 0, -1):
+            if self.stack[depth].tag == tag:
+                del self.stack[depth:]
+                return
+
+    def handle_data(self, data):
+        self.stack[-1].children.append(data)
+
+
+def parse_html(source: str) -> Node:
+    builder = _TreeBuilder()
+    builder.feed(source)
+    builder.close()
+    return builder.root
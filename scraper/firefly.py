@@ -1,49 +1,135 @@
 import json
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import date, timedelta
+from itertools import groupby, islice
 from os import environ
-from typing import Optional
+from time import monotonic
+from typing import Callable, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from scraper.common import ScrapeResults, id_for_transaction
+from scraper.common import ScrapeResults
+from scraper.journal import Journal
+from scraper.ledger import Ledger
+from scraper.metadata import MetadataCache
+from scraper.metrics import instrument_session, timed
 
 log = logging.getLogger(__name__)
 
-CURRENCY_TO_ID = {}
+# largest page firefly hands out in one response
+PAGE_LIMIT_MAX = 500
 
 
-def api_call(request, params=None, method='GET',
-             endpoint='http://localhost:5464', data=None):
-    token = environ.get('FIREFLY_TOKEN')
-    headers = {
-        'Accept': 'application/vnd.api+json, application/json, text/plain, '
-                  '*/*',
-        'Authorization': f'Bearer {token}',
-    }
-    if data:
-        data = json.dumps(data, default=str, separators=(',', ':'))
-        headers['Content-Type'] = 'application/json'
-    r = requests.request(method=method, url=f'{endpoint}/api/v1/{request}',
-                         params=params, headers=headers, data=data)
-    r.raise_for_status()
-    return r.json()
-
-
-def paginated_data_call(request, method='GET',
-                        endpoint='http://localhost:5464', **kwargs):
-    page1 = api_call(request, {
+@dataclass
+class UploadOptions:
+    workers: int = 1
+    ledger: Optional[Ledger] = None
+    journal: Optional[Journal] = None
+    reconcile_interval: Optional[timedelta] = timedelta(days=7)
+    force_reconcile: bool = False
+    metadata: Optional[MetadataCache] = None
+    # called with the id of every transaction actually created in firefly
+    on_created: Optional[Callable[[str], None]] = None
+
+
+class FireflyClient:
+    def __init__(self, endpoint='http://localhost:5464', token=None,
+                 pool_size=10, retries=5, backoff_factor=0.5,
+                 page_workers=4):
+        self.endpoint = endpoint.rstrip('/')
+        self.page_workers = max(1, page_workers)
+        token = token or environ.get('FIREFLY_TOKEN')
+        self.session = instrument_session(requests.Session(), 'firefly',
+                                          '/api/v1')
+        self.session.headers.update({
+            'Accept': 'application/vnd.api+json, application/json, '
+                      'text/plain, */*',
+            'Authorization': f'Bearer {token}',
+            'Connection': 'keep-alive',
+        })
+        # POST is retried too, uploads carry error_if_duplicate_hash so a
+        # replayed create is rejected by firefly instead of duplicated
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=None,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=retry,
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def api_call(self, request, params=None, method='GET', data=None):
+        headers = {}
+        if data:
+            data = json.dumps(data, default=str, separators=(',', ':'))
+            headers['Content-Type'] = 'application/json'
+        r = self.session.request(
+            method=method,
+            url=f'{self.endpoint}/api/v1/{request}',
+            params=params,
+            headers=headers,
+            data=data,
+        )
+        r.raise_for_status()
+        return r.json()
+
+    def close(self):
+        self.session.close()
+
+
+def paginated_data_call(request, client: FireflyClient, method='GET',
+                        limit: Optional[int] = None, **kwargs):
+    if limit:
+        kwargs['limit'] = limit
+    page1 = client.api_call(request, {
         'page': '1',
         **kwargs
-    }, method, endpoint)
+    }, method)
     yield from page1['data']
-    for page in range(2, page1['meta']['pagination']['total_pages'] + 1):
-        yield from \
-        api_call(request, {'page': page, **kwargs}, method, endpoint)['data']
+    total_pages = page1['meta']['pagination']['total_pages']
+    if total_pages < 2:
+        return
+
+    def fetch(page):
+        return client.api_call(request, {'page': page, **kwargs}, method)
+
+    # keep at most page_workers requests in flight and hand pages out in
+    # order, so consumers start on page 2 while later pages still load
+    pages = iter(range(2, total_pages + 1))
+    with ThreadPoolExecutor(max_workers=client.page_workers) as executor:
+        pending = deque(
+            executor.submit(fetch, page)
+            for page in islice(pages, client.page_workers)
+        )
+        try:
+            while pending:
+                data = pending.popleft().result()['data']
+                for page in islice(pages, 1):
+                    pending.append(executor.submit(fetch, page))
+                yield from data
+        finally:
+            for future in pending:
+                future.cancel()
 
 
-def account_get_all(endpoint: str):
-    yield from paginated_data_call('accounts', type='asset', endpoint=endpoint)
+def account_get_all(client: FireflyClient, limit=PAGE_LIMIT_MAX):
+    yield from paginated_data_call('accounts', client, type='asset',
+                                   limit=limit)
 
 
 def account_create(
@@ -71,7 +157,7 @@ def account_create(
         latitude: float = 0.0,
         longitude: float = 0.0,
         zoom_level: int = 0,
-        endpoint: str = None,
+        client: FireflyClient = None,
 ):
     data = {
         'name': name,
@@ -107,39 +193,68 @@ def account_create(
             cleanup.add(k)
     for k in cleanup:
         data.pop(k)
-    return api_call(
+    return client.api_call(
         request='accounts',
         method='POST',
-        endpoint=endpoint,
         data=data,
     )
 
 
-def currency_get_all(endpoint: str):
-    for currency in paginated_data_call('currencies', endpoint=endpoint):
-        CURRENCY_TO_ID[currency['attributes']['code']] = int(currency['id'])
+def currency_get_all(client: FireflyClient, limit=PAGE_LIMIT_MAX):
+    return {
+        currency['attributes']['code']: currency['id']
+        for currency in paginated_data_call('currencies', client, limit=limit)
+    }
+
+
+def account_numbers_get_all(client: FireflyClient, limit=PAGE_LIMIT_MAX):
+    return {
+        account['attributes']['account_number']: account['id']
+        for account in account_get_all(client, limit)
+        if account['attributes'].get('account_number')
+    }
 
 
 def transaction_get_all(
-        endpoint: str,
+        client: FireflyClient,
         start: Optional[date] = None,
         end: Optional[date] = None,
-        query_type='all'
+        query_type='all',
+        limit=PAGE_LIMIT_MAX,
 ):
     # type query_type : all, withdrawal, withdrawals, expense, deposit,
     # deposits, income, transfer, transfers, opening_balance,
     # reconciliation, special, specials, default
     yield from paginated_data_call(
         'transactions',
-        endpoint=endpoint,
+        client,
+        start=start.strftime("%Y-%m-%d") if start else '',
+        end=end.strftime("%Y-%m-%d") if end else '',
+        type=query_type,
+        limit=limit,
+    )
+
+
+def account_transaction_get_all(
+        client: FireflyClient,
+        account_id,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        query_type='all',
+        limit=PAGE_LIMIT_MAX,
+):
+    yield from paginated_data_call(
+        f'accounts/{account_id}/transactions',
+        client,
         start=start.strftime("%Y-%m-%d") if start else '',
         end=end.strftime("%Y-%m-%d") if end else '',
         type=query_type,
+        limit=limit,
     )
 
 
 def transaction_create(
-        endpoint: str,
+        client: FireflyClient,
         t_date: date,
         amount: float,
         description: str,
@@ -161,10 +276,9 @@ def transaction_create(
         t_target_id = 4
         t_source = account_name
         t_source_id = account_id
-    return api_call(
+    return client.api_call(
         request='transactions',
         method='POST',
-        endpoint=endpoint,
         data={
             # "group_title": f"{t_date} {t_type} of {amount}",
             "error_if_duplicate_hash": True,
@@ -200,103 +314,278 @@ def transaction_create(
     )
 
 
-def update_account(account_id, account_number, result, currency_t, endpoint):
-    date_min = None
-    date_max = None
-    transaction_by_id = set()
-    for currency, entries in result.transactions.items():
-        if currency != currency_t:
-            continue
-        for entry in entries:
-            if entry['date'] is None:
-                continue
-            if date_min is None or entry['date'] < date_min:
-                date_min = entry['date'] - timedelta(days=1)
-            if date_max is None or entry['date'] > date_max:
-                date_max = entry['date'] + timedelta(days=1)
-            transaction_by_id.add(
-                id_for_transaction(entry, currency, account_number)
-            )
-    for entry in transaction_get_all(endpoint, date_min, date_max):
+@timed
+def update_account(account_id, account_number, result, currency_t,
+                   client: FireflyClient,
+                   options: Optional[UploadOptions] = None):
+    options = options or UploadOptions()
+    entries = [
+        (entry.transaction_id(currency_t, account_number), entry)
+        for entry in result.transactions.get(currency_t, [])
+    ]
+    failures = sync_account(account_id, account_number, result, currency_t,
+                            client, options, entries)
+    if options.journal is not None:
+        failed = {entry_id for entry_id, _, _ in failures}
+        options.journal.mark_done(
+            entry_id for entry_id, _ in entries if entry_id not in failed
+        )
+    return failures
+
+
+def sync_account(account_id, account_number, result, currency_t,
+                 client: FireflyClient, options: UploadOptions, entries):
+    ledger = options.ledger
+    transaction_by_id = {
+        entry_id: entry.date
+        for entry_id, entry in entries
+        if entry.date is not None
+    }
+    reconcile = ledger is not None and (
+        options.force_reconcile
+        or ledger.reconcile_due(account_number, options.reconcile_interval)
+    )
+    if ledger is not None and not reconcile:
+        unknown = ledger.missing(account_number, transaction_by_id)
+        transaction_by_id = {
+            k: v for k, v in transaction_by_id.items() if k in unknown
+        }
+        if not transaction_by_id:
+            log.info(f'{account_number}: nothing new according to ledger')
+            return []
+    if not transaction_by_id:
+        return []
+    date_min = min(transaction_by_id.values()) - timedelta(days=1)
+    date_max = max(transaction_by_id.values()) + timedelta(days=1)
+    found = []
+    for entry in account_transaction_get_all(client, account_id,
+                                             date_min, date_max):
         for transaction in entry['attributes']['transactions']:
             internal_id = transaction['internal_reference']
-            if internal_id in transaction_by_id:
-                transaction_by_id.remove(internal_id)
-    for currency, entries in result.transactions.items():
-        if currency != currency_t:
-            continue
-        account_name = f'{result.bank} {currency.upper()}'
-        for entry in entries:
-            if 'serial' not in entry:
-                continue
-            entry_id = id_for_transaction(entry, currency, account_number)
-            if entry_id not in transaction_by_id:
-                continue
-            transaction_create(
-                endpoint,
-                entry['date'],
-                entry['value'],
-                entry['description'],
-                currency,
-                account_name,
-                account_id,
-                f"balance: {entry['balance']} serial: {entry['serial']}",
-                entry_id,
-                "",
-                entry['value_date'],
-            )
+            if internal_id:
+                found.append((internal_id,
+                              date.fromisoformat(transaction['date'][:10])))
+            transaction_by_id.pop(internal_id, None)
+    if reconcile:
+        ledger.reconcile(account_number, found, date_min, date_max)
+    elif ledger is not None:
+        ledger.add(account_number, found)
+    account_name = f'{result.bank} {currency_t.upper()}'
+    jobs = [
+        (entry_id, (
+            client,
+            entry.date,
+            entry.value,
+            entry.description,
+            currency_t,
+            account_name,
+            account_id,
+            f"balance: {entry.balance} serial: {entry.serial}",
+            entry_id,
+            "",
+            entry.value_date,
+        ))
+        for entry_id, entry in entries
+        if entry_id in transaction_by_id
+    ]
+
+    def uploaded(entry_id, t_date):
+        if ledger is not None:
+            ledger.add(account_number, [(entry_id, t_date)])
+
+    return upload_transactions(jobs, options.workers, uploaded,
+                               options.on_created)
+
+
+def upload_transactions(jobs, workers=1, on_uploaded=None, on_created=None):
+    # creates are submitted oldest first in the order the bank reported
+    # them. firefly lists a day's transactions in creation order, so with
+    # several workers each day is still created by one worker in order and
+    # only different days run concurrently
+    jobs.sort(key=lambda job: job[1][1] or date.min)
+    failures = []
+    if not jobs:
+        return failures
 
+    def create(job):
+        entry_id, create_args = job
+        try:
+            transaction_create(*create_args)
+            if on_created:
+                on_created(entry_id)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 422 \
+                    or 'duplicate' not in e.response.text.lower():
+                return entry_id, create_args[1], e
+            log.debug(f'transaction {entry_id} already uploaded')
+        except requests.RequestException as e:
+            return entry_id, create_args[1], e
+        if on_uploaded:
+            on_uploaded(entry_id, create_args[1])
+        return None
 
-def firefly_upload(result: ScrapeResults, endpoint: str):
-    currency_get_all(endpoint)
+    def create_day(day_jobs):
+        return [create(job) for job in day_jobs]
+
+    started = monotonic()
+    if workers > 1:
+        days = [
+            list(day_jobs)
+            for _, day_jobs in groupby(jobs, key=lambda job: job[1][1])
+        ]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            outcomes = [
+                outcome
+                for day_outcomes in executor.map(create_day, days)
+                for outcome in day_outcomes
+            ]
+    else:
+        outcomes = create_day(jobs)
+    for outcome in outcomes:
+        if outcome is not None:
+            log.warning(f'failed to upload transaction {outcome[0]}: '
+                        f'{outcome[2]}')
+            failures.append(outcome)
+    elapsed = monotonic() - started
+    # warning so the throughput shows at the default log level
+    log.warning(f'uploaded {len(jobs) - len(failures)}/{len(jobs)} '
+                f'transactions in {elapsed:.2f}s '
+                f'({len(jobs) / max(elapsed, 1e-6):.1f}/s, {workers} workers)')
+    return failures
 
-    for account in account_get_all(endpoint):
-        number = account['attributes'].get('account_number')
-        cleanup = []
-        for currency in result.transactions.keys():
-            if number == f'{result.account}-{currency}':
-                update_account(account['id'], number, result, currency, endpoint)
-                cleanup.append(currency)
-        for currency in cleanup:
-            result.transactions.pop(currency)
 
+@timed
+def firefly_upload(result: ScrapeResults, client: FireflyClient,
+                   options: Optional[UploadOptions] = None):
+    options = options or UploadOptions()
+    metadata = options.metadata or MetadataCache()
+    failures = {}
     for currency in result.transactions.keys():
-        opening_balance = 0.0,
-        opening_balance_date = date.today()
-        for t in result.transactions.get(currency, []):
-            if t['date'] is not None and t['date'] < opening_balance_date:
-                opening_balance_date = t['date'] - timedelta(days=1)
-                opening_balance = t['balance'] - t['value']
         number = f'{result.account}-{currency}'
+        account_id = find_account(number, client, metadata) \
+            or create_account(result, currency, client, metadata)
+        try:
+            failures[currency] = update_account(
+                account_id, number, result, currency, client, options,
+            )
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+            # the cached id belongs to an account deleted since
+            log.info(f'firefly account {account_id} for {number} is gone')
+            metadata.invalidate('accounts')
+            account_id = find_account(number, client, metadata) \
+                or create_account(result, currency, client, metadata)
+            failures[currency] = update_account(
+                account_id, number, result, currency, client, options,
+            )
+    return failures
+
+
+def find_account(number: str, client: FireflyClient,
+                 metadata: MetadataCache) -> Optional[str]:
+    return metadata.get('accounts', number,
+                        lambda: account_numbers_get_all(client))
+
+
+def create_account(result: ScrapeResults, currency: str,
+                   client: FireflyClient, metadata: MetadataCache) -> str:
+    # opens the account the day before the oldest transaction we have, with
+    # the balance it had then
+    opening_balance = 0.0
+    opening_balance_date = date.today()
+    for t in result.transactions.get(currency, []):
+        if t.date is not None and t.date < opening_balance_date:
+            opening_balance_date = t.date - timedelta(days=1)
+            opening_balance = t.balance - t.value
+    number = f'{result.account}-{currency}'
+    account_id = account_create(
+        name=f'{result.bank} {currency.upper()}',
+        account_type='asset',
+        account_role='defaultAsset',
+        account_number=number,
+        opening_balance=opening_balance,
+        opening_balance_date=opening_balance_date if opening_balance else None,
+        client=client,
+        active=True,
+        include_net_worth=True,
+        currency_code=currency,
+        currency_id=metadata.get('currencies', currency.upper(),
+                                 lambda: currency_get_all(client)),
+        credit_card_type='monthlyFull',
+        monthly_payment_date=date(2020, 1, 1),
+        liability_type='loan',
+        liability_direction='credit',
+        interest=0.0,
+        interest_period='monthly',
+    )['data']['id']
+    metadata.put('accounts', number, account_id)
+    return account_id
+
+
+def push_net_worth(result: ScrapeResults, total: float,
+                   client: FireflyClient, metadata: MetadataCache,
+                   day: Optional[date] = None):
+    # an asset account tracks the portfolio value. the change since the
+    # last push is booked as a transfer from the cash wallet, at most once
+    # a day so a daemon refreshing every few minutes adds one entry a day
+    day = day or date.today()
+    number = f'{result.account}-stocks'
+    name = f'{result.bank} Stocks'
+    total = round(total, 2)
+    account_id = find_account(number, client, metadata)
+    if account_id is None:
         account = account_create(
-            name=f'{result.bank} {currency.upper()}',
+            name=name,
             account_type='asset',
-            account_role='defaultAsset',
+            account_role='savingAsset',
             account_number=number,
-            opening_balance=opening_balance,
-            opening_balance_date=opening_balance_date if opening_balance else None,
-            endpoint=endpoint,
+            opening_balance=total,
+            opening_balance_date=day if total else None,
+            client=client,
             active=True,
             include_net_worth=True,
-            currency_code=currency,
-            currency_id=CURRENCY_TO_ID[currency.upper()],
-            credit_card_type='monthlyFull',
-            monthly_payment_date=date(2020, 1, 1),
-            liability_type='loan',
-            liability_direction='credit',
-            interest=0.0,
-            interest_period='monthly',
+            currency_code='nis',
+            currency_id=metadata.get('currencies', 'NIS',
+                                     lambda: currency_get_all(client)),
         )['data']
-        update_account(account['id'], number, result, currency, endpoint)
+        metadata.put('accounts', number, account['id'])
+        log.info(f'opened {name} at {total}')
+        return
+    internal_id = f'{number}-{day.isoformat()}'
+    for entry in account_transaction_get_all(client, account_id, day, day):
+        if any(t['internal_reference'] == internal_id
+               for t in entry['attributes']['transactions']):
+            log.debug(f'{name} already revalued on {day}')
+            return
+    balance = float(client.api_call(
+        f'accounts/{account_id}'
+    )['data']['attributes']['current_balance'])
+    change = round(total - balance, 2)
+    if not change:
+        return
+    try:
+        transaction_create(
+            client, day, change, 'portfolio revaluation', 'nis', name,
+            account_id, f'portfolio value: {total}', internal_id, '', None,
+        )
+    except requests.HTTPError as e:
+        if e.response is None or e.response.status_code != 422 \
+                or 'duplicate' not in e.response.text.lower():
+            raise
+        log.debug(f'{name} already revalued on {day}')
+        return
+    log.info(f'moved {name} by {change} to {total}')
 
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
+    client_x = FireflyClient('http://localhost:5464')
     log.info('connected to firefly server version {version}'.format(
-        **api_call('about')['data']))
+        **client_x.api_call('about')['data']))
 
     result_x = ScrapeResults()
     from firefly_secret import test_enrich
 
     test_enrich(result_x)
-    firefly_upload(result_x, 'http://localhost:5464')
+    firefly_upload(result_x, client_x)
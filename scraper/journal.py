@@ -0,0 +1,111 @@
+import json
+import logging
+from os import fsync, makedirs, path, replace
+from threading import Lock
+from typing import Dict, Iterable, List
+
+from scraper.common import ScrapeResults, Transaction
+
+log = logging.getLogger(__name__)
+
+
+# append-only log of scraped transactions and their upload state
+class Journal:
+    def __init__(self, filename: str):
+        makedirs(path.dirname(filename) or '.', exist_ok=True)
+        self.filename = filename
+        self.lock = Lock()
+        self.pending = self._load()
+        self.file = open(filename, 'a', encoding='utf-8')
+
+    def _load(self) -> Dict[str, dict]:
+        pending = {}
+        if not path.exists(self.filename):
+            return pending
+        with open(self.filename, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a torn last line from a crash mid-write
+                    log.warning(f'skipping corrupt journal line in '
+                                f'{self.filename}')
+                    continue
+                if record['op'] == 'add':
+                    pending[record['id']] = record
+                elif record['op'] == 'done':
+                    pending.pop(record['id'], None)
+        return pending
+
+    def _append(self, records: Iterable[dict]):
+        written = False
+        for record in records:
+            self.file.write(json.dumps(
+                record, ensure_ascii=False, separators=(',', ':')
+            ) + '\n')
+            written = True
+        if written:
+            self.file.flush()
+            fsync(self.file.fileno())
+
+    def record(self, result: ScrapeResults) -> int:
+        added = []
+        with self.lock:
+            for currency, entries in result.transactions.items():
+                number = f'{result.account}-{currency}'
+                for entry in entries:
+                    entry_id = entry.transaction_id(currency, number)
+                    if entry_id in self.pending:
+                        continue
+                    record = {
+                        'op': 'add',
+                        'id': entry_id,
+                        'bank': result.bank,
+                        'account': result.account,
+                        'currency': currency,
+                        'entry': entry.to_dict(),
+                    }
+                    self.pending[entry_id] = record
+                    added.append(record)
+            self._append(added)
+        log.info(f'journaled {len(added)} new transactions, '
+                 f'{len(self.pending)} pending upload')
+        return len(added)
+
+    def mark_done(self, ids: Iterable[str]):
+        with self.lock:
+            done = [i for i in ids if i in self.pending]
+            for entry_id in done:
+                self.pending.pop(entry_id)
+            self._append({'op': 'done', 'id': i} for i in done)
+
+    def pending_results(self) -> List[ScrapeResults]:
+        results = {}
+        with self.lock:
+            records = list(self.pending.values())
+        for record in records:
+            key = (record['bank'], record['account'])
+            if key not in results:
+                results[key] = ScrapeResults(*key, transactions={})
+            results[key].transactions.setdefault(
+                record['currency'], []
+            ).append(Transaction.from_dict(record['entry']))
+        return list(results.values())
+
+    def compact(self):
+        # rewrite the log keeping only what is still pending
+        with self.lock:
+            self.file.close()
+            with open(f'{self.filename}.tmp', 'w', encoding='utf-8') as f:
+                for record in self.pending.values():
+                    f.write(json.dumps(
+                        record, ensure_ascii=False, separators=(',', ':')
+                    ) + '\n')
+                f.flush()
+                fsync(f.fileno())
+            replace(f'{self.filename}.tmp', self.filename)
+            self.file = open(self.filename, 'a', encoding='utf-8')
+
+    def close(self):
+        with self.lock:
+            self.file.close()
@@ -0,0 +1,112 @@
+import logging
+import sqlite3
+from datetime import date, datetime, timedelta
+from os import makedirs, path
+from threading import Lock
+from typing import Iterable, Optional, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS uploaded (
+    account_number TEXT NOT NULL,
+    internal_id TEXT NOT NULL,
+    t_date TEXT,
+    PRIMARY KEY (account_number, internal_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS reconciled (
+    account_number TEXT PRIMARY KEY,
+    at TEXT NOT NULL
+);
+'''
+# stays well under the sqlite bound parameter limit
+CHUNK = 500
+
+
+class Ledger:
+    def __init__(self, filename: str):
+        makedirs(path.dirname(filename) or '.', exist_ok=True)
+        self.lock = Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def missing(self, account_number: str, ids: Iterable[str]) -> Set[str]:
+        ids = list(ids)
+        known = set()
+        with self.lock:
+            for i in range(0, len(ids), CHUNK):
+                chunk = ids[i:i + CHUNK]
+                known.update(row[0] for row in self.db.execute(
+                    f'SELECT internal_id FROM uploaded '
+                    f'WHERE account_number = ? AND internal_id IN '
+                    f'({",".join("?" * len(chunk))})',
+                    (account_number, *chunk),
+                ))
+        return set(ids) - known
+
+    def add(self, account_number: str,
+            entries: Iterable[Tuple[str, Optional[date]]]):
+        with self.lock, self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO uploaded VALUES (?, ?, ?)',
+                (
+                    (account_number, internal_id,
+                     t_date.isoformat() if t_date else None)
+                    for internal_id, t_date in entries
+                ),
+            )
+
+    def reconcile(self, account_number: str,
+                  entries: Iterable[Tuple[str, Optional[date]]],
+                  start: Optional[date], end: Optional[date]):
+        # entries is everything firefly reported in [start, end], anything
+        # else the ledger holds for that window was deleted in firefly
+        entries = list(entries)
+        present = {internal_id for internal_id, _ in entries}
+        with self.lock, self.db:
+            stale = [
+                row[0] for row in self.db.execute(
+                    'SELECT internal_id FROM uploaded '
+                    'WHERE account_number = ? AND t_date >= ? AND t_date <= ?',
+                    (account_number,
+                     (start or date.min).isoformat(),
+                     (end or date.max).isoformat()),
+                )
+                if row[0] not in present
+            ]
+            if stale:
+                log.info(f'ledger drift on {account_number}: '
+                         f'{len(stale)} entries no longer in firefly')
+            self.db.executemany(
+                'DELETE FROM uploaded '
+                'WHERE account_number = ? AND internal_id = ?',
+                ((account_number, internal_id) for internal_id in stale),
+            )
+            self.db.executemany(
+                'INSERT OR REPLACE INTO uploaded VALUES (?, ?, ?)',
+                (
+                    (account_number, internal_id,
+                     t_date.isoformat() if t_date else None)
+                    for internal_id, t_date in entries
+                ),
+            )
+            self.db.execute(
+                'INSERT OR REPLACE INTO reconciled VALUES (?, ?)',
+                (account_number, datetime.now().isoformat()),
+            )
+
+    def reconcile_due(self, account_number: str,
+                      interval: Optional[timedelta]) -> bool:
+        if interval is None:
+            return False
+        with self.lock:
+            row = self.db.execute(
+                'SELECT at FROM reconciled WHERE account_number = ?',
+                (account_number,),
+            ).fetchone()
+        if row is None:
+            return True
+        return datetime.now() - datetime.fromisoformat(row[0]) >= interval
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,112 @@
+import logging
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+from selenium.webdriver.common.by import By
+from selenium.webdriver.remote.webdriver import WebDriver
+
+log = logging.getLogger(__name__)
+
+# finds the first rendered element under a selector whose text matches, in
+# one round trip. the css paths it resolved before are tried first and only
+# trusted when the text at that path still matches
+LOCATE_SCRIPT = """
+const [selector, text, exact, normalize, cached] = arguments;
+const clean = value => {
+    value = value || '';
+    if (normalize) {
+        value = value
+            .replace(/[\\u05F4\\u201C\\u201D\\u201E]|''/g, '"')
+            .replace(/[\\u05F3\\u2018\\u2019\\u201A`\\u00B4]/g, "'")
+            .replace(/[\\s\\u200E\\u200F\\u202A-\\u202E]+/g, ' ')
+            .trim();
+    }
+    return value;
+};
+const wanted = clean(text);
+const matches = element => {
+    if (!element || !element.getClientRects().length) return false;
+    const value = clean(element.innerText);
+    return exact ? value === wanted : value.includes(wanted);
+};
+const cssPath = element => {
+    const parts = [];
+    for (let node = element; node && node.nodeType === 1;
+            node = node.parentElement) {
+        if (node.id && document.querySelectorAll(
+                '#' + CSS.escape(node.id)).length === 1) {
+            parts.unshift('#' + CSS.escape(node.id));
+            break;
+        }
+        let index = 1;
+        for (let sibling = node.previousElementSibling; sibling;
+                sibling = sibling.previousElementSibling) {
+            if (sibling.tagName === node.tagName) index++;
+        }
+        parts.unshift(node.tagName.toLowerCase()
+                      + ':nth-of-type(' + index + ')');
+    }
+    return parts.join(' > ');
+};
+const version = location.pathname;
+const known = cached && cached[version];
+if (known) {
+    const element = document.querySelector(known);
+    if (element && element.matches(selector) && matches(element)) {
+        return [element, known, version];
+    }
+}
+for (const element of document.querySelectorAll(selector)) {
+    if (matches(element)) return [element, cssPath(element), version];
+}
+return null;
+"""
+SELECTOR_PREFIX = {
+    By.CSS_SELECTOR: '',
+    By.CLASS_NAME: '.',
+    By.ID: '#',
+    By.TAG_NAME: '',
+}
+
+
+def css_selector(by, value) -> Optional[str]:
+    prefix = SELECTOR_PREFIX.get(by)
+    return None if prefix is None else prefix + value
+
+
+class Locator:
+    def __init__(self):
+        self.lock = Lock()
+        # (selector, text, exact, normalize) -> {page version: css path}
+        self.paths: Dict[Tuple[str, str, bool, bool], Dict[str, str]] = {}
+
+    def find(self, driver: WebDriver, by, value, text, exact=True,
+             normalize=True):
+        selector = css_selector(by, value)
+        if selector is None:
+            return self.find_slow(driver, by, value, text, exact)
+        key = (selector, text, exact, normalize)
+        with self.lock:
+            cached = dict(self.paths.get(key, {}))
+        found = driver.execute_script(LOCATE_SCRIPT, selector, text, exact,
+                                      normalize, cached)
+        if not found:
+            return None
+        element, css_path, version = found
+        if cached.get(version) != css_path:
+            with self.lock:
+                self.paths.setdefault(key, {})[version] = css_path
+            log.debug(f"resolved {text} to {css_path} on {version}")
+        return element
+
+    @staticmethod
+    def find_slow(driver: WebDriver, by, value, text, exact=True):
+        # locators that have no css form, one round trip per candidate
+        for element in driver.find_elements(by=by, value=value):
+            if (exact and element.text == text) \
+                    or (not exact and text in element.text):
+                return element
+        return None
+
+
+LOCATOR = Locator()
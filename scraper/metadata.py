@@ -0,0 +1,74 @@
+import json
+import logging
+from datetime import datetime, timedelta
+from os import path
+from threading import Lock
+from typing import Callable, Dict, Optional
+
+from scraper.state import write_json_atomic
+
+log = logging.getLogger(__name__)
+
+
+# firefly ids that rarely change (currency code -> id, account number -> id)
+# kept on disk so a run can skip listing them. a table is reloaded once it
+# is older than the ttl, or the first time a lookup misses in this process
+class MetadataCache:
+    def __init__(self, filename: Optional[str] = None,
+                 ttl: timedelta = timedelta(days=1)):
+        self.filename = filename
+        self.ttl = ttl
+        self.lock = Lock()
+        self.tables = self._load()
+        self.reloaded = set()
+
+    def _load(self) -> Dict[str, dict]:
+        if not self.filename or not path.exists(self.filename):
+            return {}
+        try:
+            with open(self.filename, encoding='utf-8') as f:
+                return json.load(f)
+        except ValueError:
+            log.warning(f'ignoring unreadable metadata cache {self.filename}')
+            return {}
+
+    def _save(self):
+        if self.filename:
+            write_json_atomic(self.filename, self.tables)
+
+    def _expired(self, table: dict) -> bool:
+        fetched = datetime.fromisoformat(table['fetched'])
+        return datetime.now() - fetched > self.ttl
+
+    def get(self, kind: str, key: str,
+            load: Callable[[], Dict[str, str]]) -> Optional[str]:
+        with self.lock:
+            table = self.tables.get(kind)
+            if table is None or self._expired(table) \
+                    or (key not in table['ids'] and kind not in self.reloaded):
+                table = self.tables[kind] = {
+                    'fetched': datetime.now().isoformat(),
+                    'ids': load(),
+                }
+                self.reloaded.add(kind)
+                self._save()
+                log.debug(f'reloaded {len(table["ids"])} firefly {kind}')
+            return table['ids'].get(key)
+
+    def put(self, kind: str, key: str, value: str):
+        with self.lock:
+            table = self.tables.setdefault(kind, {
+                'fetched': datetime.now().isoformat(), 'ids': {},
+            })
+            table['ids'][key] = value
+            self._save()
+
+    def invalidate(self, kind: Optional[str] = None):
+        with self.lock:
+            if kind is None:
+                self.tables.clear()
+                self.reloaded.clear()
+            else:
+                self.tables.pop(kind, None)
+                self.reloaded.discard(kind)
+            self._save()
@@ -0,0 +1,204 @@
+import json
+import logging
+import re
+from contextlib import contextmanager
+from functools import wraps
+from os import makedirs, path, replace
+from threading import Lock, local
+from time import monotonic, time
+from urllib.parse import urlsplit
+
+log = logging.getLogger(__name__)
+
+PREFIX = 'mizrahi_scraper'
+ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = Lock()
+        self.context = local()
+        self.started = time()
+        self.stages = {}
+        self.webdriver = {}
+        self.http = {}
+        self.waits = {}
+
+    def current_stage(self) -> str:
+        stack = getattr(self.context, 'stack', None)
+        return stack[-1] if stack else ''
+
+    @contextmanager
+    def stage(self, name: str):
+        stack = self.context.__dict__.setdefault('stack', [])
+        stack.append(name)
+        started = monotonic()
+        try:
+            yield
+        finally:
+            elapsed = monotonic() - started
+            stack.pop()
+            with self.lock:
+                stage = self.stages.setdefault(name, {
+                    'runs': 0, 'seconds': 0.0, 'webdriver_commands': 0,
+                })
+                stage['runs'] += 1
+                stage['seconds'] += elapsed
+            log.debug(f"stage {name} took {elapsed:.2f}s")
+
+    def record_webdriver(self, command: str):
+        stage = self.current_stage()
+        with self.lock:
+            self.webdriver[command] = self.webdriver.get(command, 0) + 1
+            if stage in self.stages:
+                self.stages[stage]['webdriver_commands'] += 1
+            elif stage:
+                self.stages[stage] = {
+                    'runs': 0, 'seconds': 0.0, 'webdriver_commands': 1,
+                }
+
+    def record_http(self, service: str, method: str, endpoint: str,
+                    size: int, seconds: float, status: int):
+        key = f'{service} {method} {endpoint}'
+        with self.lock:
+            stats = self.http.setdefault(key, {
+                'service': service, 'method': method, 'endpoint': endpoint,
+                'requests': 0, 'bytes': 0, 'seconds': 0.0, 'errors': 0,
+                'max_seconds': 0.0,
+            })
+            stats['requests'] += 1
+            stats['bytes'] += size
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            if status >= 400:
+                stats['errors'] += 1
+
+    def record_wait(self, label: str, seconds: float):
+        with self.lock:
+            stats = self.waits.setdefault(label, {'count': 0, 'seconds': 0.0})
+            stats['count'] += 1
+            stats['seconds'] += seconds
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return json.loads(json.dumps({
+                'started': self.started,
+                'duration': time() - self.started,
+                'stages': self.stages,
+                'webdriver_commands': self.webdriver,
+                'http': list(self.http.values()),
+                'waits': self.waits,
+            }))
+
+    def to_prometheus(self) -> str:
+        data = self.to_dict()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(
+                    f'{k}="{escape_label(v)}"' for k, v in labels.items()
+                )
+                if label_text:
+                    label_text = f'{{{label_text}}}'
+                lines.append(f'{PREFIX}_{name}{label_text} {value}')
+
+        metric('run_duration_seconds', 'gauge', 'wall time of the run',
+               [({}, data['duration'])])
+        metric('last_run_timestamp_seconds', 'gauge', 'when the run started',
+               [({}, data['started'])])
+        stages = data['stages'].items()
+        metric('stage_seconds', 'gauge', 'wall time spent per stage',
+               [({'stage': k}, v['seconds']) for k, v in stages])
+        metric('stage_runs', 'gauge', 'times each stage ran',
+               [({'stage': k}, v['runs']) for k, v in stages])
+        metric('stage_webdriver_commands', 'gauge',
+               'webdriver commands issued per stage',
+               [({'stage': k}, v['webdriver_commands']) for k, v in stages])
+        metric('webdriver_commands', 'gauge',
+               'webdriver commands issued per command',
+               [({'command': k}, v)
+                for k, v in data['webdriver_commands'].items()])
+        http_labels = [
+            ({'service': h['service'], 'method': h['method'],
+              'endpoint': h['endpoint']}, h) for h in data['http']
+        ]
+        metric('http_requests', 'gauge', 'http requests per endpoint',
+               [(labels, h['requests']) for labels, h in http_labels])
+        metric('http_response_bytes', 'gauge', 'response bytes per endpoint',
+               [(labels, h['bytes']) for labels, h in http_labels])
+        metric('http_request_seconds', 'gauge', 'total latency per endpoint',
+               [(labels, h['seconds']) for labels, h in http_labels])
+        metric('http_request_max_seconds', 'gauge',
+               'slowest request per endpoint',
+               [(labels, h['max_seconds']) for labels, h in http_labels])
+        metric('http_errors', 'gauge', 'error responses per endpoint',
+               [(labels, h['errors']) for labels, h in http_labels])
+        metric('wait_seconds', 'gauge', 'time spent in readiness waits',
+               [({'wait': k}, v['seconds'])
+                for k, v in data['waits'].items()])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, stem: str):
+        # writes <stem>.json and <stem>.prom, the latter renamed into place
+        # so a node exporter textfile collector never reads half a file
+        stem = re.sub(r'\.(json|prom)$', '', stem)
+        makedirs(path.dirname(stem) or '.', exist_ok=True)
+        for suffix, content in (
+                ('.json', json.dumps(self.to_dict(), indent=1)),
+                ('.prom', self.to_prometheus()),
+        ):
+            with open(f'{stem}{suffix}.tmp', 'w', encoding='utf-8') as f:
+                f.write(content)
+            replace(f'{stem}{suffix}.tmp', f'{stem}{suffix}')
+        log.info(f"wrote metrics to {stem}.json and {stem}.prom")
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+METRICS = Metrics()
+
+
+def timed(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with METRICS.stage(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def instrument_driver(driver):
+    # counts every command sent over the remote connection of this driver
+    executor = driver.command_executor
+    execute = executor.execute
+
+    def counted_execute(command, params):
+        METRICS.record_webdriver(command)
+        return execute(command, params)
+
+    executor.execute = counted_execute
+    return driver
+
+
+def instrument_session(session, service: str, strip_prefix: str = ''):
+    def record(response, *args, **kwargs):
+        endpoint = urlsplit(response.url).path
+        if strip_prefix and endpoint.startswith(strip_prefix):
+            endpoint = endpoint[len(strip_prefix):]
+        METRICS.record_http(
+            service,
+            response.request.method,
+            ID_SEGMENT.sub('/{id}', endpoint),
+            len(response.content or b''),
+            response.elapsed.total_seconds(),
+            response.status_code,
+        )
+
+    session.hooks['response'].append(record)
+    return session
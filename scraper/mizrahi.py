@@ -1,69 +1,241 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 from os import environ
+from typing import Callable, Dict, List, Optional, Tuple
 
+import requests
 from selenium import webdriver
-from selenium.common.exceptions import NoSuchElementException, \
-    WebDriverException
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver import Keys
 from selenium.webdriver.common.by import By
 from selenium.webdriver.remote.webdriver import WebDriver
 from selenium.webdriver.support import expected_conditions as ec
-from selenium.webdriver.support.wait import WebDriverWait
 
-from scraper.common import ScrapeResults, find_element_by_text, safe_click, \
-    clean_float, date_parse
+from scraper.common import ScrapeResults, clean_float, date_parse, \
+    ScrapeOptions, Transaction
+from scraper.direct import DirectClient, NIS_REQUIRED, install_capture, \
+    learn_nis_endpoint, load_endpoints
+from scraper.dom import parse_html
+from scraper.metrics import instrument_driver, timed
+from scraper.readiness import probe, wait_element, wait_elements, wait_for, \
+    wait_frame, wait_grid_ready, wait_idle, wait_grid_changed, \
+    wait_element_by_text, safe_click, GRID_SIGNATURE_SCRIPT
+from scraper.session import restore_session, save_session, dump_session, \
+    load_session, is_authenticated
+from scraper.snapshots import save_snapshot, load_snapshot
 
 log = logging.getLogger(__name__)
-
-
-def scrape(target, capabilities) -> ScrapeResults:
-    result = ScrapeResults()
-    result.bank = 'Mizrahi Tefahot'
-    driver = webdriver.Remote(
-        command_executor=target,
-        desired_capabilities=capabilities,
-    )
-    driver.maximize_window()
-    driver.get("https://www.mizrahi-tefahot.co.il/")
+# resizes or pages the kendo grid, through the widget when the page exposes
+# one and through the pager controls otherwise
+GRID_PAGER_SCRIPT = """
+const action = arguments[0];
+const element = document.querySelector('.k-grid');
+if (!element) return null;
+const widget = window.jQuery && window.jQuery(element).data('kendoGrid');
+if (action === 'maximize') {
+    // pageSizes may also be true, meaning kendo's defaults, which are
+    // only known to the rendered select below
+    const options = widget && widget.pager
+        && widget.pager.options.pageSizes;
+    if (Array.isArray(options)) {
+        const sizes = options.map(Number).filter(n => n > 0);
+        const max = Math.max(...sizes);
+        if (!sizes.length || widget.dataSource.pageSize() >= max) return null;
+        widget.dataSource.pageSize(max);
+        return max;
+    }
+    const select = element.querySelector('.k-pager-sizes select');
+    if (!select) return null;
+    const sizes = Array.from(select.options, o => parseInt(o.value, 10))
+        .filter(n => n > 0);
+    const max = Math.max(...sizes);
+    if (!sizes.length || parseInt(select.value, 10) >= max) return null;
+    select.value = String(max);
+    select.dispatchEvent(new Event('change', {bubbles: true}));
+    return max;
+}
+if (action === 'next') {
+    if (widget) {
+        const source = widget.dataSource;
+        if (source.page() >= source.totalPages()) return false;
+        source.page(source.page() + 1);
+        return true;
+    }
+    const next = element.querySelector(
+        '.k-pager-next, .k-pager-nav[title*="next" i]');
+    if (!next || next.classList.contains('k-disabled')
+            || next.classList.contains('k-state-disabled')
+            || next.getAttribute('aria-disabled') === 'true') return false;
+    next.click();
+    return true;
+}
+return null;
+"""
+
+HOME_PAGE = "https://www.mizrahi-tefahot.co.il/"
+
+META = 'meta.json'
+NIS_ROWS = 'nis_rows.json'
+FOREIGN_BALANCES = 'foreign_balances.html'
+FOREIGN_TRANSACTIONS = 'foreign_transactions.html'
+STOCKS = 'stocks.html'
+
+MAX_GRID_PAGES = 200
+
+FOREIGN_FULL_RANGE = date(2021, 1, 1)
+FOREIGN_CURRENCIES = {
+    'דולר': 'usd',
+    'אירו': 'eur',
+}
+
+# returns every grid row as a list of [column name, text] pairs in a single
+# round trip, the column name is what cell.accessible_name used to resolve to
+GRID_ROWS_SCRIPT = """
+const rows = document.getElementsByClassName(arguments[0]);
+const headers = new Map();
+return Array.from(rows, row => {
+    const grid = row.closest('.k-grid') || document;
+    if (!headers.has(grid)) {
+        headers.set(grid, Array.from(
+            grid.querySelectorAll('.k-grid-header th'),
+            th => (th.getAttribute('data-title')
+                   || th.getAttribute('aria-label')
+                   || th.innerText || '').trim()
+        ));
+    }
+    const names = headers.get(grid);
+    return Array.from(row.cells, (cell, i) => [
+        (cell.getAttribute('aria-label') || names[i] || '').trim(),
+        cell.innerText,
+    ]);
+});
+"""
+
+
+@timed
+def scrape(target, capabilities,
+           options: Optional[ScrapeOptions] = None) -> ScrapeResults:
+    session = ScrapeSession(target, capabilities)
     try:
-        scrape_detect_login(driver)
-        scrape_perform_login(driver)
-        return scrape_process(driver, result)
-
+        return session.scrape(options or ScrapeOptions())
     finally:
-        driver.quit()
-
-
+        session.quit()
+
+
+# a browser that stays logged in between scrapes, scrape() uses a fresh one
+# per call while the daemon keeps one across refreshes
+class ScrapeSession:
+    def __init__(self, target, capabilities):
+        self.target = target
+        self.capabilities = capabilities
+        self.driver: Optional[WebDriver] = None
+
+    def connect(self) -> WebDriver:
+        return instrument_driver(webdriver.Remote(
+            command_executor=self.target,
+            desired_capabilities=self.capabilities,
+        ))
+
+    def open(self, options: ScrapeOptions):
+        self.driver = self.connect()
+        # every wait is explicit, element lookups never block on their own
+        self.driver.implicitly_wait(0)
+        if options.window_size:
+            self.driver.set_window_size(*options.window_size)
+        else:
+            self.driver.maximize_window()
+        self.driver.get(HOME_PAGE)
+        self.login(options)
+
+    def login(self, options: ScrapeOptions):
+        driver = self.driver
+        if not options.session_file \
+                or not restore_session(driver, options.session_file):
+            if options.session_file:
+                driver.get(HOME_PAGE)
+            scrape_detect_login(driver)
+            scrape_perform_login(driver, options)
+
+    def ensure_logged_in(self, options: ScrapeOptions):
+        if self.driver is None:
+            self.open(options)
+            return
+        try:
+            # the sections navigate from the main menu, which any page of
+            # a live session has
+            self.driver.refresh()
+            wait_idle(self.driver)
+            if is_authenticated(self.driver):
+                log.debug("reusing the logged in browser")
+                return
+            log.info("bank session expired, logging in again")
+            self.driver.get(HOME_PAGE)
+            self.login(options)
+        except WebDriverException as e:
+            log.warning(f"lost the browser session, reconnecting: {e}")
+            self.quit()
+            self.open(options)
+
+    def scrape(self, options: ScrapeOptions,
+               logout: bool = True) -> ScrapeResults:
+        self.ensure_logged_in(options)
+        result = ScrapeResults()
+        result.bank = 'Mizrahi Tefahot'
+        return scrape_process(self.driver, result, options, self.connect,
+                              logout)
+
+    def logout(self):
+        if self.driver is None:
+            return
+        try:
+            for button in probe(self.driver, By.CLASS_NAME, "lnkExitWebSite"):
+                button.click()
+                wait_element(self.driver, By.CLASS_NAME, "goToLogin", 20)
+                break
+        except WebDriverException:
+            pass
+
+    def quit(self):
+        if self.driver is None:
+            return
+        try:
+            self.driver.quit()
+        except WebDriverException as e:
+            log.debug(f"could not quit the browser cleanly: {e}")
+        self.driver = None
+
+
+@timed
 def scrape_detect_login(driver: WebDriver):
     log.debug("starting login")
     if '/loginca/' in driver.current_url:
         log.debug("detected legacy login page, redirecting to home page")
-        driver.find_element(
-            by=By.CLASS_NAME,
-            value="home-page-link",
-        ).click()
-    login_button = driver.find_element(by=By.ID, value="logInBtn")
+        wait_element(driver, By.CLASS_NAME, "home-page-link").click()
+    login_button = wait_element(driver, By.ID, "logInBtn")
     log.debug("found login button")
     assert login_button.text == "כניסה לחשבון"
     log.debug("login text matches, proceeding")
     safe_click(driver, login_button)
 
 
-def scrape_perform_login(driver: WebDriver):
-    driver.implicitly_wait(2)
-
+@timed
+def scrape_perform_login(driver: WebDriver, options: ScrapeOptions):
     log.debug("waiting for login popup dialog")
-    WebDriverWait(driver, 60).until(
-        ec.invisibility_of_element_located((By.CLASS_NAME, "sk-ball-spin"))
+    wait_for(
+        driver,
+        ec.invisibility_of_element_located((By.CLASS_NAME, "sk-ball-spin")),
+        60,
+        "login spinner",
     )
     log.debug("login popup dialog detected")
 
-    driver.switch_to.frame(driver.find_element(By.CSS_SELECTOR, "iframe"))
-    username_f = driver.find_element(by=By.CLASS_NAME, value="input_user")
-    password_f = driver.find_element(by=By.CLASS_NAME, value="input_pass")
-    username = environ.get("MIZRAHI_USERNAME")
+    wait_frame(driver, (By.CSS_SELECTOR, "iframe"))
+    username_f = wait_element(driver, By.CLASS_NAME, "input_user")
+    password_f = wait_element(driver, By.CLASS_NAME, "input_pass")
+    username = options.username or environ.get("MIZRAHI_USERNAME")
     assert username
-    password = environ.get("MIZRAHI_PASSWORD")
+    password = options.password or environ.get("MIZRAHI_PASSWORD")
     assert password
     username_f.send_keys(username)
     password_f.send_keys(password)
@@ -72,50 +244,53 @@ def scrape_perform_login(driver: WebDriver):
     log.debug("username and password submitted")
 
 
-def scrape_process(driver: WebDriver, result: ScrapeResults) -> ScrapeResults:
-    driver.implicitly_wait(10)
-
+def scrape_process(driver: WebDriver, result: ScrapeResults,
+                   options: ScrapeOptions,
+                   connect: Optional[Callable[[], WebDriver]] = None,
+                   logout: bool = True) -> ScrapeResults:
     log.debug("waiting for main website to load")
-    exit_button = WebDriverWait(driver, 60).until(
-        ec.element_to_be_clickable((By.CLASS_NAME, "lnkExitWebSite"))
-    )
+    exit_button = wait_element(driver, By.CLASS_NAME, "lnkExitWebSite", 60,
+                               clickable=True)
     log.debug("main website loaded")
 
-    result.account = driver.find_element(
+    result.account = wait_element(
+        driver,
         By.XPATH,
         '//div[@class="containerKendoSelect"]/span/span/span/div/span',
     ).text
     assert result.account
 
     try:
-        for btn in driver.find_elements(
-                By.ID, "ctl00_ContentPlaceHolder2_btnSave"
-        ):
+        wait_idle(driver)
+        for btn in probe(driver, By.ID, "ctl00_ContentPlaceHolder2_btnSave"):
             log.debug("skipping details confirmation request dialog")
             safe_click(driver, btn)
 
-        process_chequing_nis(driver, result)
-
-        process_chequing_foreign(driver, result)
-
-        process_stocks(driver, result)
+        if options.parallel_sections and connect:
+            scrape_sections_parallel(driver, result, options, connect)
+        else:
+            for section in SECTIONS:
+                section(driver, result, options)
 
         return result
 
     finally:
-        if exit_button:
+        if options.session_file:
+            # keep the bank session alive for the next run
+            save_session(driver, options.session_file)
+        elif logout and exit_button:
             try:
-                driver.implicitly_wait(1)
                 exit_button.click()
-                driver.implicitly_wait(20)
-                driver.find_element(by=By.CLASS_NAME, value="goToLogin")
+                wait_element(driver, By.CLASS_NAME, "goToLogin", 20)
             except WebDriverException:
                 pass
 
 
-def process_chequing_nis(driver: WebDriver, result: ScrapeResults):
+@timed
+def process_chequing_nis(driver: WebDriver, result: ScrapeResults,
+                         options: ScrapeOptions):
     log.debug("switching to chequing account")
-    safe_click(driver, find_element_by_text(
+    safe_click(driver, wait_element_by_text(
         driver,
         By.CSS_SELECTOR,
         "#mainMenu > ul > li > a",
@@ -127,17 +302,22 @@ def process_chequing_nis(driver: WebDriver, result: ScrapeResults):
     # ))  # עובר ושב
 
     log.debug("detecting nis balance")
-    nis_balance = find_element_by_text(driver, By.CLASS_NAME, "sky-big3", "₪",
-                                       exact=False)
+    nis_balance = wait_element_by_text(driver, By.CLASS_NAME, "sky-big3",
+                                       "₪", exact=False)
     result.nis = clean_float(nis_balance.text)
+    if options.direct and options.state_dir \
+            and process_chequing_nis_direct(driver, result, options):
+        return
     log.debug("loading nis transactions from past year")
-    safe_click(driver, find_element_by_text(
+    if options.direct and options.state_dir:
+        install_capture(driver)
+    safe_click(driver, wait_element_by_text(
         driver,
         By.CSS_SELECTOR,
         "ul.sub-menu-items > li > a",
         "יתרה ותנועות בחשבון"
     ))
-    safe_click(driver, find_element_by_text(
+    safe_click(driver, wait_element_by_text(
         driver,
         By.CSS_SELECTOR,
         ".linkPannel > button",
@@ -145,16 +325,13 @@ def process_chequing_nis(driver: WebDriver, result: ScrapeResults):
     ))
 
     for checkbox in ("checkAsmachta", "checkTnuotHayomKodmot"):
-        element = WebDriverWait(driver, 10).until(
-            ec.element_to_be_clickable((By.ID, checkbox))
-        )
+        element = wait_element(driver, By.ID, checkbox, 10, clickable=True)
         if not element.get_attribute('checked'):
             log.debug(f"clicking unchecked element {checkbox}")
             safe_click(driver, element)
 
-    WebDriverWait(driver, 30).until(
-        ec.presence_of_all_elements_located((By.CLASS_NAME, "k-master-row"))
-    )
+    wait_idle(driver)
+    wait_grid_ready(driver)
     # for _ in range(3):
     #     try:
     #         driver.find_elements(by=By.CLASS_NAME, value="k-master-row")[
@@ -162,34 +339,159 @@ def process_chequing_nis(driver: WebDriver, result: ScrapeResults):
     #         break
     #     except (StaleElementReferenceException, WebDriverException):
     #         pass
+    read_nis_grid(driver, result, options)
+
+
+def read_nis_grid(driver: WebDriver, result: ScrapeResults,
+                  options: ScrapeOptions):
+    page_size = driver.execute_script(GRID_PAGER_SCRIPT, 'maximize')
+    if page_size:
+        log.debug(f"switched nis grid to {page_size} rows per page")
+        wait_idle(driver)
+        wait_grid_ready(driver)
+
+    since = options.since(f'{result.account}-nis')
+    rows = []
+    for page in range(1, MAX_GRID_PAGES + 1):
+        page_rows = driver.execute_script(GRID_ROWS_SCRIPT, "k-master-row")
+        rows.extend(page_rows)
+        add_nis_entries(result, page_rows, options)
+        if page == 1:
+            first_rows = page_rows
+        if before_window(page_rows, since):
+            log.debug(f"nis page {page} is older than {since}, stopping")
+            break
+        signature = driver.execute_script(GRID_SIGNATURE_SCRIPT)
+        if not driver.execute_script(GRID_PAGER_SCRIPT, 'next'):
+            break
+        wait_grid_changed(driver, signature)
+    else:
+        log.warning(f"stopped paging the nis grid after {MAX_GRID_PAGES}")
+    log.debug(f"read {len(rows)} nis rows from {page} grid pages")
+    if rows and options.direct and options.state_dir:
+        # once paging is over, the request for the first page is known to
+        # have been one of several
+        learn_nis_endpoint(driver, first_rows, options.state_dir,
+                           paged=page > 1)
+    record_nis_rows(result, rows, options)
+
+
+def before_window(rows, since: Optional[date]) -> bool:
+    # only meaningful when the grid lists the newest transactions first
+    if not since:
+        return False
+    dates = [
+        date_parse(text) for row in rows for name, text in row
+        if name == 'תאריך' and text
+    ]
+    return bool(dates) and dates[0] >= dates[-1] and dates[0] < since
+
+
+@timed
+def process_chequing_nis_direct(driver: WebDriver, result: ScrapeResults,
+                                options: ScrapeOptions) -> bool:
+    spec = load_endpoints(options.state_dir).get('nis')
+    if not spec:
+        return False
+    client = DirectClient.from_driver(driver, options.direct_base_url)
+    try:
+        rows = client.fetch_rows(spec, options.record_dir)
+    except (requests.RequestException, ValueError) as e:
+        log.warning(f"direct nis fetch failed, using the browser: {e}")
+        return False
+    finally:
+        client.close()
+    add_nis_rows(result, rows, options)
+    log.debug(f"fetched {len(rows)} nis rows directly")
+    return True
+
+
+def add_nis_rows(result: ScrapeResults, rows, options: ScrapeOptions):
+    record_nis_rows(result, rows, options)
+    add_nis_entries(result, rows, options)
+
+
+def record_nis_rows(result: ScrapeResults, rows, options: ScrapeOptions):
+    if options.record_dir:
+        save_snapshot(options.record_dir, NIS_ROWS, rows)
+        save_snapshot(options.record_dir, META, {
+            'bank': result.bank,
+            'account': result.account,
+            'nis': result.nis,
+        })
+
 
-    for row in driver.find_elements(By.CLASS_NAME, "k-master-row"):
-        cells = row.get_property('cells')
-        if len(cells) != 9:
+def add_nis_entries(result: ScrapeResults, rows, options: ScrapeOptions):
+    since = options.since(f'{result.account}-nis')
+    entries = []
+    for row in rows:
+        if not NIS_REQUIRED <= {name for name, _ in row}:
+            continue
+        entry = parse_nis_row(row)
+        if since and entry.date and entry.date < since:
             continue
-        entry = {
-            cell.accessible_name: cell.text
-            for cell in cells
-            if cell.accessible_name
-        }
-        entry['date'] = date_parse(entry.pop('תאריך'))
-        entry['value_date'] = date_parse(entry.pop('תאריך ערך', ''))
-        entry['balance'] = clean_float(entry.pop('יתרה בש"ח'))
-        entry['value'] = clean_float(entry.pop('זכות/חובה'))
-        entry['serial'] = entry.pop('אסמכתה')
-        entry['description'] = entry.pop('סוג תנועה')
-        entry.pop('לחץ לפתיחת הרחבה', None)
-        result.transactions['nis'].append(entry)
-    # todo: handle next page button
-
-
-def process_chequing_foreign(driver: WebDriver, result: ScrapeResults):
-    safe_click(driver, find_element_by_text(
+        entries.append(entry)
+    add_transactions(result, 'nis', entries, options)
+
+
+def scrape_sections_parallel(driver: WebDriver, result: ScrapeResults,
+                             options: ScrapeOptions,
+                             connect: Callable[[], WebDriver]):
+    # a webdriver session executes one command at a time whatever tab it is
+    # on, so the other sections run in sibling sessions carrying our cookies
+    state = dump_session(driver)
+
+    def run_sibling(section) -> ScrapeResults:
+        partial = ScrapeResults(result.bank, result.account)
+        sibling = connect()
+        try:
+            sibling.implicitly_wait(0)
+            if not load_session(sibling, state):
+                raise WebDriverException(
+                    f"sibling session for {section.__name__} is not logged in"
+                )
+            section(sibling, partial, options)
+            return partial
+        finally:
+            sibling.quit()
+
+    with ThreadPoolExecutor(max_workers=len(SECTIONS) - 1) as executor:
+        futures = [executor.submit(run_sibling, s) for s in SECTIONS[1:]]
+        SECTIONS[0](driver, result, options)
+        for future in futures:
+            merge_results(result, future.result())
+
+
+def merge_results(result: ScrapeResults, partial: ScrapeResults):
+    result.nis = partial.nis or result.nis
+    result.usd = partial.usd or result.usd
+    result.eur = partial.eur or result.eur
+    result.stocks.extend(partial.stocks)
+    for currency, entries in partial.transactions.items():
+        result.transactions.setdefault(currency, []).extend(entries)
+
+
+def parse_nis_row(cells) -> Transaction:
+    entry = {name: text for name, text in cells if name}
+    return Transaction(
+        date_parse(entry['תאריך']),
+        date_parse(entry.get('תאריך ערך', '')),
+        entry['סוג תנועה'],
+        entry['אסמכתה'],
+        clean_float(entry['זכות/חובה']),
+        clean_float(entry['יתרה בש"ח']),
+    )
+
+
+@timed
+def process_chequing_foreign(driver: WebDriver, result: ScrapeResults,
+                             options: ScrapeOptions):
+    safe_click(driver, wait_element_by_text(
         driver, By.CLASS_NAME, "sub-menu-parent", "עו''ש מט''ח"
     ))
     safe_click(
         driver,
-        find_element_by_text(
+        wait_element_by_text(
             driver,
             By.CSS_SELECTOR,
             "ul.sub-menu-items > li > a",
@@ -197,106 +499,171 @@ def process_chequing_foreign(driver: WebDriver, result: ScrapeResults):
         )
     )
 
-    try:
-        driver.implicitly_wait(0)
-        driver.find_element(By.CLASS_NAME, "error_msg")
+    wait_idle(driver)
+    if probe(driver, By.CLASS_NAME, "error_msg"):
         return
-    except NoSuchElementException:
-        pass
-
-    driver.implicitly_wait(10)
-    driver.switch_to.frame("contentFrame")
-    currencies = len(driver.find_elements(By.CLASS_NAME, "header3")) - 1
 
-    for nth in range(0, currencies):
-        currency = driver.find_element(
-            By.ID,
-            f"ctl00_ContentPlaceHolder2_Repeater1_ctl0{nth}_lblMtbea"
-        ).get_attribute("innerText")
-
-        value = clean_float(driver.find_element(
-            by=By.CSS_SELECTOR,
-            value=f"#ctl00_ContentPlaceHolder2_Repeater1_ctl0"
-                  f"{nth}_grvDelayedCheque_ctl00__1 > td:nth-child("
-                  f"2)").get_attribute(
-            "innerText"))
-        if "דולר" in currency:
-            result.usd = value
-        elif "אירו" in currency:
-            result.eur = value
+    wait_frame(driver, "contentFrame")
+    wait_elements(driver, By.CLASS_NAME, "header3")
+    source = snapshot(driver, FOREIGN_BALANCES, options)
     driver.switch_to.default_content()
+    apply_foreign_balances(result, parse_foreign_balances(source))
 
-    safe_click(driver, find_element_by_text(
+    safe_click(driver, wait_element_by_text(
         driver,
         By.CSS_SELECTOR,
         "ul.sub-menu-items > li > a",
         "תנועות בחשבון"
     ))
-    driver.implicitly_wait(10)
-    driver.switch_to.frame("contentFrame")
-    start_date = driver.find_element(
+    wait_frame(driver, "contentFrame")
+    start_date = wait_element(
+        driver,
         By.ID,
         "ctl00_ContentPlaceHolder2_SkyDateRangePicker1_SkyDatePicker1ID_"
         "radDatePickerID_dateInput"
     )
+    # a currency that never had a transaction never gets a watermark, it
+    # only forces the full range while no other currency has one either
+    known = [
+        options.since(f'{result.account}-{code}')
+        for code in FOREIGN_CURRENCIES.values()
+    ]
+    since = min((d for d in known if d is not None),
+                default=FOREIGN_FULL_RANGE)
+    log.debug(f"loading foreign transactions since {since}")
     start_date.send_keys(Keys.CONTROL + "a")
-    start_date.send_keys("01/01/2021")
+    start_date.send_keys(since.strftime("%d/%m/%Y"))
     start_date.send_keys(Keys.RETURN)
 
-    currencies = {
-        'דולר': 'usd',
-        'אירו': 'eur',
-    }
-    driver.implicitly_wait(10)
-    for n in (0, 4):
-        header_elements = driver.find_elements(
-            By.ID,
-            f'ctl00_ContentPlaceHolder2_Repeater1_ctl0{n}'
-            f'_ctl00_ContentPlaceHolder2_Repeater1_ctl0{n}_PageAjaxPanel1Panel'
+    wait_idle(driver)
+    if probe(driver, By.ID, foreign_panel_id(0)):
+        wait_for(driver, ec.visibility_of_element_located(
+            (By.ID, foreign_currency_label_id(0))
+        ), 10, "foreign currency label")
+    source = snapshot(driver, FOREIGN_TRANSACTIONS, options)
+    driver.switch_to.default_content()
+    apply_foreign_transactions(result, parse_foreign_transactions(source),
+                               options)
+
+
+def foreign_currency_code(name: str) -> Optional[str]:
+    for hebrew, code in FOREIGN_CURRENCIES.items():
+        if hebrew in name:
+            return code
+    return None
+
+
+def foreign_panel_id(n: int) -> str:
+    return f'ctl00_ContentPlaceHolder2_Repeater1_ctl0{n}' \
+           f'_ctl00_ContentPlaceHolder2_Repeater1_ctl0{n}_PageAjaxPanel1Panel'
+
+
+def foreign_currency_label_id(n: int) -> str:
+    return f'ctl00_ContentPlaceHolder2_Repeater1_ctl0{n}_lblShemMatbea'
+
+
+def parse_foreign_balances(source: str) -> List[Tuple[str, Optional[float]]]:
+    document = parse_html(source)
+    currencies = len(list(document.iter(cls="header3"))) - 1
+    balances = []
+    for nth in range(0, currencies):
+        currency = document.get_element_by_id(
+            f"ctl00_ContentPlaceHolder2_Repeater1_ctl0{nth}_lblMtbea"
+        )
+        row = document.get_element_by_id(
+            f"ctl00_ContentPlaceHolder2_Repeater1_ctl0"
+            f"{nth}_grvDelayedCheque_ctl00__1"
         )
-        if not header_elements:
+        if currency is None or row is None:
             continue
-        currency = WebDriverWait(driver, 10).until(
-            ec.visibility_of_element_located((
-                By.ID,
-                f'ctl00_ContentPlaceHolder2_Repeater1_ctl0{n}_lblShemMatbea'
-            ))
-        ).text
-        for row in header_elements[0].find_elements(By.CSS_SELECTOR, 'tr'):
-            cells = row.get_property('cells')
+        cells = [c for c in row.elements() if c.tag == 'td']
+        if len(cells) < 2:
+            continue
+        balances.append(
+            (currency.inner_text(), clean_float(cells[1].inner_text()))
+        )
+    return balances
+
+
+def parse_foreign_transactions(source: str) \
+        -> Dict[str, List[Transaction]]:
+    document = parse_html(source)
+    transactions = {}
+    for n in (0, 4):
+        panel = document.get_element_by_id(foreign_panel_id(n))
+        label = document.get_element_by_id(foreign_currency_label_id(n))
+        if panel is None or label is None:
+            continue
+        entries = transactions.setdefault(label.inner_text(), [])
+        for row in panel.iter('tr'):
+            cells = [cell.inner_text() for cell in row.cells]
             if len(cells) != 6:
                 continue
-            if cells[0].text == 'תאריך':
+            if cells[0] == 'תאריך':
                 continue
-            result.transactions[currencies[currency]].append(
-                {
-                    'date': date_parse(cells[0].text),
-                    'value_date': date_parse(cells[1].text),
-                    'description': cells[2].text,
-                    'serial': cells[3].text,
-                    'value': clean_float(cells[4].text),
-                    'balance': clean_float(cells[5].text),
-                }
-            )
-    driver.switch_to.default_content()
+            entries.append(Transaction(
+                date_parse(cells[0]),
+                date_parse(cells[1]),
+                cells[2],
+                cells[3],
+                clean_float(cells[4]),
+                clean_float(cells[5]),
+            ))
+    return transactions
+
+
+def apply_foreign_balances(result: ScrapeResults, balances):
+    for currency, value in balances:
+        code = foreign_currency_code(currency)
+        if code == 'usd':
+            result.usd = value
+        elif code == 'eur':
+            result.eur = value
+
+
+def apply_foreign_transactions(result: ScrapeResults, transactions,
+                               options: Optional[ScrapeOptions] = None):
+    for currency, entries in transactions.items():
+        code = foreign_currency_code(currency)
+        if code is None:
+            log.warning(f"skipping transactions in unknown currency "
+                        f"{currency}")
+            continue
+        add_transactions(result, code, entries, options)
+
+
+def add_transactions(result: ScrapeResults, currency: str,
+                     entries: List[Transaction],
+                     options: Optional[ScrapeOptions] = None):
+    # hands the entries to the streaming uploader as soon as they are parsed
+    result.transactions.setdefault(currency, []).extend(entries)
+    if entries and options is not None and options.sink is not None:
+        options.sink(result, currency, entries)
 
 
-def process_stocks(driver: WebDriver, result: ScrapeResults):
-    driver.implicitly_wait(10)
-    safe_click(driver, driver.find_element(
-        by=By.CSS_SELECTOR,
-        value="#mainMenu > ul > li:nth-child(5) > a"
+@timed
+def process_stocks(driver: WebDriver, result: ScrapeResults,
+                   options: ScrapeOptions):
+    safe_click(driver, wait_element(
+        driver,
+        By.CSS_SELECTOR,
+        "#mainMenu > ul > li:nth-child(5) > a"
     ))  # שוק ההון
-    try:
-        driver.find_element(By.CLASS_NAME, "miz-notification-messages")
-    except NoSuchElementException:
+    wait_idle(driver)
+    if not probe(driver, By.CLASS_NAME, "miz-notification-messages"):
         return
-    for tr in driver.find_elements(by=By.CSS_SELECTOR,
-                                   value="tr.k-master-row"):
-        stock_dump = tr.get_attribute("innerText").split("\n")
+    if probe(driver, By.CLASS_NAME, "k-grid"):
+        wait_grid_ready(driver)
+    result.stocks.extend(parse_stocks(snapshot(driver, STOCKS, options)))
+
+
+def parse_stocks(source: str) -> List[dict]:
+    stocks = []
+    for tr in parse_html(source).iter('tr', 'k-master-row'):
+        stock_dump = tr.inner_text().split("\n")
         if len(stock_dump) < 15:
             continue
-        result.stocks.append({
+        stocks.append({
             "fullName": stock_dump[1],
             "bankSymbol": stock_dump[2],
             "price": clean_float(stock_dump[4]),
@@ -304,3 +671,37 @@ def process_stocks(driver: WebDriver, result: ScrapeResults):
             "profitPercent": clean_float(stock_dump[13]),
             "profitNis": clean_float(stock_dump[14]),
         })
+    return stocks
+
+
+def snapshot(driver: WebDriver, name: str, options: ScrapeOptions) -> str:
+    source = driver.page_source
+    if options.record_dir:
+        save_snapshot(options.record_dir, name, source)
+    return source
+
+
+def replay(directory: str) -> ScrapeResults:
+    result = ScrapeResults()
+    meta = load_snapshot(directory, META, {})
+    result.bank = meta.get('bank', 'Mizrahi Tefahot')
+    result.account = meta.get('account', '')
+    result.nis = meta.get('nis', 0.0)
+    add_nis_rows(result, load_snapshot(directory, NIS_ROWS, []),
+                 ScrapeOptions())
+    source = load_snapshot(directory, FOREIGN_BALANCES)
+    if source:
+        apply_foreign_balances(result, parse_foreign_balances(source))
+    source = load_snapshot(directory, FOREIGN_TRANSACTIONS)
+    if source:
+        apply_foreign_transactions(result, parse_foreign_transactions(source))
+    source = load_snapshot(directory, STOCKS)
+    if source:
+        result.stocks.extend(parse_stocks(source))
+    log.info(f"replayed {directory}: "
+             f"{sum(map(len, result.transactions.values()))} transactions, "
+             f"{len(result.stocks)} stocks")
+    return result
+
+
+SECTIONS = (process_chequing_nis, process_chequing_foreign, process_stocks)
@@ -0,0 +1,160 @@
+import logging
+from time import monotonic
+
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver import Keys
+from selenium.webdriver.remote.webdriver import WebDriver
+from selenium.webdriver.support import expected_conditions as ec
+from selenium.webdriver.support.wait import WebDriverWait
+
+from scraper.locator import LOCATOR
+from scraper.metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+POLL = 0.1
+
+# counts in-flight XHR/fetch requests from the moment it is first run on a
+# document, together with jQuery, ASP.NET AJAX postbacks and visible
+# spinners this tells whether the page settled
+PAGE_IDLE_SCRIPT = """
+if (!window.__pendingRequests) {
+    window.__pendingRequests = {count: 0};
+    const pending = window.__pendingRequests;
+    const send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        pending.count++;
+        this.addEventListener('loadend', () => pending.count--, {once: true});
+        return send.apply(this, arguments);
+    };
+    if (window.fetch) {
+        const fetch = window.fetch;
+        window.fetch = function () {
+            pending.count++;
+            return fetch.apply(this, arguments)
+                .finally(() => pending.count--);
+        };
+    }
+}
+if (document.readyState !== 'complete') return false;
+if (window.__pendingRequests.count > 0) return false;
+if (window.jQuery && window.jQuery.active > 0) return false;
+try {
+    if (Sys.WebForms.PageRequestManager.getInstance()
+            .get_isInAsyncPostBack()) return false;
+} catch (e) {}
+const spinners = document.querySelectorAll(
+    '.sk-ball-spin, .k-loading-mask, .k-loading-image');
+for (const spinner of spinners) {
+    if (spinner.offsetParent !== null) return false;
+}
+return true;
+"""
+GRID_READY_SCRIPT = """
+const grids = document.querySelectorAll('.k-grid');
+if (!grids.length) return false;
+for (const grid of grids) {
+    if (grid.querySelector('.k-loading-mask')) return false;
+    if (!grid.querySelector('.k-master-row, .k-grid-norecords')) return false;
+}
+return true;
+"""
+
+GRID_SIGNATURE_SCRIPT = """
+const row = document.querySelector('.k-grid .k-master-row');
+return row ? row.innerText : null;
+"""
+
+
+def probe(driver: WebDriver, by, value) -> list:
+    # for elements that are optional on the page. never blocks, sessions
+    # are opened with an implicit wait of 0
+    return driver.find_elements(by, value)
+
+
+def wait_for(driver: WebDriver, condition, timeout=30, label=None,
+             poll=POLL):
+    label = label or getattr(condition, '__name__', repr(condition))
+    started = monotonic()
+    try:
+        return WebDriverWait(driver, timeout, poll_frequency=poll).until(
+            condition
+        )
+    except TimeoutException:
+        log.warning(f"gave up waiting for {label} after {timeout}s")
+        raise
+    finally:
+        elapsed = monotonic() - started
+        METRICS.record_wait(label, elapsed)
+        log.debug(f"waited {elapsed:.2f}s for {label}")
+
+
+def wait_element(driver: WebDriver, by, value, timeout=30, clickable=False):
+    condition = ec.element_to_be_clickable if clickable \
+        else ec.presence_of_element_located
+    return wait_for(driver, condition((by, value)), timeout, value)
+
+
+def wait_elements(driver: WebDriver, by, value, timeout=30) -> list:
+    return wait_for(
+        driver, ec.presence_of_all_elements_located((by, value)), timeout,
+        value,
+    )
+
+
+def wait_idle(driver: WebDriver, timeout=30):
+    wait_for(driver, lambda d: d.execute_script(PAGE_IDLE_SCRIPT), timeout,
+             "page idle")
+
+
+def wait_grid_ready(driver: WebDriver, timeout=30):
+    wait_for(driver, lambda d: d.execute_script(GRID_READY_SCRIPT), timeout,
+             "grid data bound")
+
+
+def wait_grid_changed(driver: WebDriver, signature, timeout=30):
+    # a new page is bound once its first row differs from the old first row
+    wait_for(
+        driver,
+        lambda d: d.execute_script(GRID_READY_SCRIPT)
+        and d.execute_script(GRID_SIGNATURE_SCRIPT) != signature,
+        timeout,
+        "grid page change",
+    )
+
+
+def wait_frame(driver: WebDriver, frame, timeout=30):
+    # frame is a name/id or a locator tuple, the driver ends up switched in
+    label = frame if isinstance(frame, str) else frame[1]
+    wait_for(driver, ec.frame_to_be_available_and_switch_to_it(frame),
+             timeout, f"frame {label}")
+    wait_idle(driver, timeout)
+
+
+def find_element_by_text(driver: WebDriver, by, value, text, exact=True,
+                         normalize=True):
+    # exact compares the whole text, otherwise text is a substring of it.
+    # normalize collapses whitespace and folds hebrew and typographic
+    # quotes before comparing
+    return LOCATOR.find(driver, by, value, text, exact, normalize)
+
+
+def wait_element_by_text(driver: WebDriver, by, value, text, exact=True,
+                         timeout=30, normalize=True):
+    return wait_for(
+        driver,
+        lambda d: find_element_by_text(d, by, value, text, exact, normalize),
+        timeout,
+        text,
+    )
+
+
+def safe_click(driver: WebDriver, element, timeout=10):
+    element = wait_for(
+        driver,
+        ec.element_to_be_clickable(element),
+        timeout,
+        "clickable element",
+    )
+    driver.execute_script('arguments[0].scrollIntoView(true)', element)
+    element.send_keys(Keys.RETURN)
@@ -0,0 +1,73 @@
+import gzip
+import json
+import logging
+from os import makedirs, path, replace
+from typing import Iterable, Iterator
+
+from scraper.common import ScrapeResults, Transaction
+
+log = logging.getLogger(__name__)
+
+
+# one json record per line: an account header, then its stocks and its
+# transactions, so a reader can hand over each account as soon as the next
+# header shows up. a name ending in .gz is compressed transparently
+def open_results(filename: str, mode: str, compressed: bool):
+    if compressed:
+        return gzip.open(filename, mode + 't', encoding='utf-8')
+    return open(filename, mode, encoding='utf-8')
+
+
+def result_records(result: ScrapeResults) -> Iterator[dict]:
+    yield {
+        'type': 'account',
+        'bank': result.bank,
+        'account': result.account,
+        'nis': result.nis,
+        'usd': result.usd,
+        'eur': result.eur,
+    }
+    for stock in result.stocks:
+        yield {'type': 'stock', **stock}
+    for currency, entries in result.transactions.items():
+        for entry in entries:
+            yield {'type': 'transaction', 'currency': currency,
+                   **entry.to_dict()}
+
+
+def write_results(filename: str, results: Iterable[ScrapeResults]) -> int:
+    makedirs(path.dirname(filename) or '.', exist_ok=True)
+    count = 0
+    with open_results(f'{filename}.tmp', 'w',
+                      filename.endswith('.gz')) as f:
+        for result in results:
+            for record in result_records(result):
+                f.write(json.dumps(
+                    record, ensure_ascii=False, separators=(',', ':')
+                ) + '\n')
+            count += 1
+    replace(f'{filename}.tmp', filename)
+    log.info(f'wrote {count} scrape results to {filename}')
+    return count
+
+
+def read_results(filename: str) -> Iterator[ScrapeResults]:
+    result = None
+    with open_results(filename, 'r', filename.endswith('.gz')) as f:
+        for line in f:
+            record = json.loads(line)
+            kind = record.pop('type')
+            if kind == 'account':
+                if result is not None:
+                    yield result
+                result = ScrapeResults(**record, transactions={})
+            elif result is None:
+                raise ValueError(f'{filename} has a {kind} before any account')
+            elif kind == 'stock':
+                result.stocks.append(record)
+            elif kind == 'transaction':
+                result.transactions.setdefault(
+                    record.pop('currency'), []
+                ).append(Transaction.from_dict(record))
+    if result is not None:
+        yield result
@@ -0,0 +1,103 @@
+import json
+import logging
+from os import chmod, makedirs, path, replace
+from urllib.parse import urlsplit
+
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.remote.webdriver import WebDriver
+
+from scraper.readiness import probe, wait_for
+
+log = logging.getLogger(__name__)
+
+STORAGE_DUMP_SCRIPT = """
+const dump = storage => Object.fromEntries(
+    Array.from({length: storage.length}, (_, i) => storage.key(i))
+        .map(key => [key, storage.getItem(key)])
+);
+return {
+    local: dump(window.localStorage),
+    session: dump(window.sessionStorage),
+};
+"""
+STORAGE_LOAD_SCRIPT = """
+for (const [key, value] of Object.entries(arguments[0])) {
+    window.localStorage.setItem(key, value);
+}
+for (const [key, value] of Object.entries(arguments[1])) {
+    window.sessionStorage.setItem(key, value);
+}
+"""
+COOKIE_FIELDS = ('name', 'value', 'path', 'domain', 'secure', 'httpOnly',
+                 'expiry', 'sameSite')
+
+
+def is_authenticated(driver: WebDriver) -> bool:
+    return bool(probe(driver, By.CLASS_NAME, "lnkExitWebSite"))
+
+
+def dump_session(driver: WebDriver) -> dict:
+    return {
+        'url': driver.current_url,
+        'cookies': driver.get_cookies(),
+        'storage': driver.execute_script(STORAGE_DUMP_SCRIPT),
+    }
+
+
+def save_session(driver: WebDriver, filename: str):
+    try:
+        state = dump_session(driver)
+    except WebDriverException as e:
+        log.warning(f"could not save browser session: {e}")
+        return
+    makedirs(path.dirname(filename) or '.', exist_ok=True)
+    with open(f'{filename}.tmp', 'w', encoding='utf-8') as f:
+        chmod(f'{filename}.tmp', 0o600)
+        json.dump(state, f)
+    replace(f'{filename}.tmp', filename)
+    log.debug(f"saved {len(state['cookies'])} cookies to {filename}")
+
+
+def restore_session(driver: WebDriver, filename: str, timeout=15) -> bool:
+    if not path.exists(filename):
+        return False
+    with open(filename, encoding='utf-8') as f:
+        return load_session(driver, json.load(f), timeout)
+
+
+def load_session(driver: WebDriver, state: dict, timeout=15) -> bool:
+    url = urlsplit(state['url'])
+    if urlsplit(driver.current_url).netloc != url.netloc:
+        driver.get(f'{url.scheme}://{url.netloc}/')
+    driver.delete_all_cookies()
+    for cookie in state['cookies']:
+        # add_cookie only accepts cookies for the current host
+        if not url.netloc.endswith(cookie.get('domain', '').lstrip('.')):
+            continue
+        cookie = {k: v for k, v in cookie.items() if k in COOKIE_FIELDS}
+        if 'expiry' in cookie:
+            cookie['expiry'] = int(cookie['expiry'])
+        try:
+            driver.add_cookie(cookie)
+        except WebDriverException as e:
+            log.debug(f"skipping cookie {cookie['name']}: {e}")
+    storage = state.get('storage') or {}
+    driver.execute_script(STORAGE_LOAD_SCRIPT, storage.get('local', {}),
+                          storage.get('session', {}))
+    driver.get(state['url'])
+    try:
+        wait_for(
+            driver,
+            lambda d: probe(d, By.CLASS_NAME, "lnkExitWebSite")
+            or probe(d, By.ID, "logInBtn")
+            or '/loginca/' in d.current_url,
+            timeout,
+            "restored session page",
+        )
+    except TimeoutException:
+        pass
+    authenticated = is_authenticated(driver)
+    log.info("restored browser session is "
+             f"{'still' if authenticated else 'no longer'} authenticated")
+    return authenticated
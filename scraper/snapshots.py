@@ -0,0 +1,26 @@
+import json
+import logging
+from os import makedirs, path
+
+log = logging.getLogger(__name__)
+
+
+def save_snapshot(directory: str, name: str, content):
+    makedirs(directory, exist_ok=True)
+    filename = path.join(directory, name)
+    with open(filename, 'w', encoding='utf-8') as f:
+        if isinstance(content, str):
+            f.write(content)
+        else:
+            json.dump(content, f, ensure_ascii=False, default=str)
+    log.debug(f"recorded snapshot {filename}")
+
+
+def load_snapshot(directory: str, name: str, default=None):
+    filename = path.join(directory, name)
+    if not path.exists(filename):
+        return default
+    with open(filename, encoding='utf-8') as f:
+        if name.endswith('.json'):
+            return json.load(f)
+        return f.read()
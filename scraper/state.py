@@ -0,0 +1,56 @@
+import json
+import logging
+from datetime import date, timedelta
+from os import makedirs, path, replace
+from typing import Dict
+
+from scraper.common import ScrapeResults
+
+log = logging.getLogger(__name__)
+
+WATERMARKS = 'watermarks.json'
+
+
+def write_json_atomic(filename: str, data):
+    makedirs(path.dirname(filename) or '.', exist_ok=True)
+    with open(f'{filename}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1, default=str)
+    replace(f'{filename}.tmp', filename)
+
+
+def load_watermarks(state_dir: str) -> Dict[str, date]:
+    filename = path.join(state_dir, WATERMARKS)
+    if not path.exists(filename):
+        return {}
+    with open(filename, encoding='utf-8') as f:
+        return {
+            account: date.fromisoformat(value)
+            for account, value in json.load(f).items()
+        }
+
+
+def save_watermarks(state_dir: str, watermarks: Dict[str, date]):
+    write_json_atomic(path.join(state_dir, WATERMARKS), {
+        account: value.isoformat() for account, value in watermarks.items()
+    })
+
+
+def advance_watermarks(watermarks: Dict[str, date], result: ScrapeResults,
+                       failures: dict) -> Dict[str, date]:
+    # the watermark is the newest date for which every transaction is known
+    # to be in firefly, a failed upload holds it back to the day before
+    for currency, entries in result.transactions.items():
+        dates = [e.date for e in entries if e.date is not None]
+        if not dates:
+            continue
+        number = f'{result.account}-{currency}'
+        confirmed = max(dates)
+        if number in watermarks:
+            confirmed = max(confirmed, watermarks[number])
+        failed = [d for _, d, _ in failures.get(currency, ()) if d]
+        if failed:
+            confirmed = min(failed) - timedelta(days=1)
+        log.debug(f'sync watermark for {number} is now {confirmed}')
+        watermarks[number] = confirmed
+    return watermarks
+
@@ -0,0 +1,192 @@
+import json
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, time
+from os import makedirs, path, truncate
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from scraper.state import write_json_atomic
+
+log = logging.getLogger(__name__)
+
+SYMBOLS = 'symbols.json'
+# one file per column, rows are appended in time order. symbol holds an
+# index into symbols.json and a row is only written when a holding changed
+COLUMNS = (
+    ('at', 'd'),
+    ('symbol', 'I'),
+    ('price', 'd'),
+    ('quantity', 'd'),
+    ('profit_percent', 'd'),
+    ('profit_nis', 'd'),
+)
+# the time of every snapshot, also the ones where nothing changed
+RUNS = ('runs', 'd')
+FIELDS = ('price', 'quantity', 'profitPercent', 'profitNis')
+
+
+def as_number(value) -> float:
+    return float('nan') if value is None else float(value)
+
+
+def same(a: float, b: float) -> bool:
+    return a == b or (a != a and b != b)
+
+
+class StockStore:
+    def __init__(self, directory: str):
+        makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.symbols: List[str] = []
+        self.names: Dict[str, str] = {}
+        filename = path.join(directory, SYMBOLS)
+        if path.exists(filename):
+            with open(filename, encoding='utf-8') as f:
+                saved = json.load(f)
+            self.symbols = saved['symbols']
+            self.names = saved['names']
+        self.index = {s: i for i, s in enumerate(self.symbols)}
+        self.columns = {
+            name: self._load(name, code) for name, code in COLUMNS + (RUNS,)
+        }
+        # a crash between column appends leaves some columns a row longer,
+        # cut the files back too or the next append lands after the extra
+        # rows and the columns stay misaligned
+        rows = min(len(self.columns[name]) for name, _ in COLUMNS)
+        for name, _ in COLUMNS:
+            del self.columns[name][rows:]
+        for name, _ in COLUMNS + (RUNS,):
+            self._trim(name)
+        # the holding every symbol was last seen with
+        self.last: Dict[int, tuple] = {}
+        for row in range(len(self.columns['at'])):
+            self.last[self.columns['symbol'][row]] = self._values(row)
+
+    def _load(self, name: str, code: str) -> array:
+        column = array(code)
+        filename = path.join(self.directory, f'{name}.bin')
+        if path.exists(filename):
+            with open(filename, 'rb') as f:
+                data = f.read()
+            # a torn row left by a crash mid-append is cut off in _trim
+            column.frombytes(data[:len(data) - len(data) % column.itemsize])
+        return column
+
+    def _trim(self, name: str):
+        column = self.columns[name]
+        filename = path.join(self.directory, f'{name}.bin')
+        size = len(column) * column.itemsize
+        if path.exists(filename) and path.getsize(filename) != size:
+            log.warning(f'dropping {path.getsize(filename) - size} bytes '
+                        f'left in {name}.bin by an interrupted append')
+            truncate(filename, size)
+
+    def _values(self, row: int) -> tuple:
+        return tuple(self.columns[name][row] for name, _ in COLUMNS[2:])
+
+    def _symbol(self, symbol: str, name: str) -> int:
+        if symbol not in self.index:
+            self.index[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        self.names[symbol] = name or self.names.get(symbol, '')
+        return self.index[symbol]
+
+    def append(self, stocks: Iterable[dict],
+               at: Optional[datetime] = None) -> int:
+        at = (at or datetime.now()).timestamp()
+        if self.columns['runs'] and at < self.columns['runs'][-1]:
+            raise ValueError('stock snapshots must be appended in time order')
+        rows = []
+        seen = set()
+        for stock in stocks:
+            symbol = self._symbol(stock['bankSymbol'], stock.get('fullName'))
+            seen.add(symbol)
+            rows.append((symbol, tuple(
+                as_number(stock.get(field)) for field in FIELDS
+            )))
+        # a holding that was sold shows up as quantity 0 once
+        for symbol, values in self.last.items():
+            if symbol not in seen and values[1] != 0:
+                rows.append((symbol, (values[0], 0.0, values[2], 0.0)))
+        new = {name: array(code) for name, code in COLUMNS}
+        for symbol, values in rows:
+            last = self.last.get(symbol)
+            if last is not None and all(map(same, last, values)):
+                continue
+            self.last[symbol] = values
+            new['at'].append(at)
+            new['symbol'].append(symbol)
+            for (name, _), value in zip(COLUMNS[2:], values):
+                new[name].append(value)
+        write_json_atomic(path.join(self.directory, SYMBOLS), {
+            'symbols': self.symbols, 'names': self.names,
+        })
+        new[RUNS[0]] = array(RUNS[1], [at])
+        for name, column in new.items():
+            with open(path.join(self.directory, f'{name}.bin'), 'ab') as f:
+                column.tofile(f)
+            self.columns[name].extend(column)
+        log.info(f'stored {len(new["at"])} changed holdings out of '
+                 f'{len(rows)}')
+        return len(new['at'])
+
+    def _rows(self, start: Optional[datetime],
+              end: Optional[datetime]) -> range:
+        at = self.columns['at']
+        first = bisect_left(at, start.timestamp()) if start else 0
+        last = bisect_right(at, end.timestamp()) if end else len(at)
+        return range(first, last)
+
+    def series(self, symbol: str, start: Optional[datetime] = None,
+               end: Optional[datetime] = None) \
+            -> List[Tuple[datetime, float, float, float]]:
+        # (time, price, quantity, value) at every change of one holding
+        index = self.index.get(symbol)
+        if index is None:
+            return []
+        columns = self.columns
+        return [
+            (
+                datetime.fromtimestamp(columns['at'][row]),
+                columns['price'][row],
+                columns['quantity'][row],
+                columns['price'][row] * columns['quantity'][row],
+            )
+            for row in self._rows(start, end)
+            if columns['symbol'][row] == index
+        ]
+
+    def portfolio_by_day(self, start: Optional[date] = None,
+                         end: Optional[date] = None) \
+            -> List[Tuple[date, float]]:
+        # total holding value at the last snapshot of every day one was
+        # taken on, unchanged holdings carry over from earlier rows
+        columns = self.columns
+        values: Dict[int, float] = {}
+        totals: Dict[date, float] = {}
+        total = 0.0
+        row = 0
+        until = datetime.combine(end, time.max).timestamp() if end else None
+        for run in columns['runs']:
+            if until is not None and run > until:
+                break
+            while row < len(columns['at']) and columns['at'][row] <= run:
+                value = columns['price'][row] * columns['quantity'][row]
+                value = value if value == value else 0.0
+                symbol = columns['symbol'][row]
+                total += value - values.get(symbol, 0.0)
+                values[symbol] = value
+                row += 1
+            day = datetime.fromtimestamp(run).date()
+            if start is None or day >= start:
+                totals[day] = total
+        return sorted(totals.items())
+
+
+def portfolio_value(stocks: Iterable[dict]) -> float:
+    return sum(
+        stock['price'] * stock['quantity'] for stock in stocks
+        if stock.get('price') is not None
+        and stock.get('quantity') is not None
+    )
@@ -0,0 +1,173 @@
+import logging
+from dataclasses import replace
+from queue import Empty, Queue
+from threading import Lock, Thread
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+
+from scraper.common import ScrapeResults, Transaction
+from scraper.firefly import FireflyClient, UploadOptions, create_account, \
+    find_account, update_account
+from scraper.metadata import MetadataCache
+
+log = logging.getLogger(__name__)
+
+# (bank, account, currency), the unit a batch is uploaded in
+Key = Tuple[str, str, str]
+
+
+# uploads transactions while the scraper is still producing them. put()
+# blocks once the queue is full, so a slow firefly slows the scraper down
+# instead of piling parsed rows up in memory
+class UploadStream:
+    def __init__(self, client: FireflyClient,
+                 options: Optional[UploadOptions] = None, maxsize=1000,
+                 batch_size=200, linger=0.5):
+        self.client = client
+        self.options = replace(options or UploadOptions(),
+                               on_created=self._created)
+        self.metadata = self.options.metadata or MetadataCache()
+        # batches only check the ledger, an account due for reconciliation
+        # is reconciled once over everything streamed for it at close
+        self.batch_options = replace(self.options, force_reconcile=False,
+                                     reconcile_interval=None)
+        self.reconciling: Dict[Key, List[Transaction]] = {}
+        self.checked = set()
+        self.queue = Queue(maxsize)
+        self.batch_size = batch_size
+        self.linger = linger
+        self.deferred: Dict[Key, List[Transaction]] = {}
+        self.failures: Dict[Key, list] = {}
+        # transactions created in firefly, not the ones the ledger skipped
+        self.uploaded = 0
+        self.lock = Lock()
+        self.error: Optional[BaseException] = None
+        self.thread = Thread(target=self._run, name='upload-stream',
+                             daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def put(self, result: ScrapeResults, currency: str,
+            entries: List[Transaction]):
+        if self.error is not None:
+            raise RuntimeError('upload stream stopped') from self.error
+        key = (result.bank, result.account, currency)
+        for entry in entries:
+            self.queue.put((key, entry))
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise RuntimeError('upload stream failed') from self.error
+
+    def result_failures(self, result: ScrapeResults) -> Dict[str, list]:
+        # in the shape firefly_upload returns, for advance_watermarks
+        return {
+            currency: failures
+            for (bank, account, currency), failures in self.failures.items()
+            if (bank, account) == (result.bank, result.account)
+        }
+
+    def _run(self):
+        started = monotonic()
+        batches: Dict[Key, List[Transaction]] = {}
+        pending = 0
+        closed = False
+        try:
+            while True:
+                try:
+                    item = self.queue.get(timeout=self.linger)
+                except Empty:
+                    # the scraper paused, upload what it produced so far
+                    self._flush(batches)
+                    pending = 0
+                    continue
+                if item is None:
+                    closed = True
+                    break
+                key, entry = item
+                batches.setdefault(key, []).append(entry)
+                pending += 1
+                if pending >= self.batch_size:
+                    self._flush(batches)
+                    pending = 0
+            self._flush(batches)
+            self._flush(self.deferred, final=True)
+            self._reconcile()
+        except BaseException as e:
+            self.error = e
+            log.exception('upload stream stopped')
+            # keep draining so producers blocked in put() can finish
+            while not closed:
+                closed = self.queue.get() is None
+        log.info(f'streamed {self.uploaded} transactions to firefly in '
+                 f'{monotonic() - started:.2f}s')
+
+    def _flush(self, batches: Dict[Key, List[Transaction]], final=False):
+        for key, entries in list(batches.items()):
+            batches.pop(key)
+            if not entries:
+                continue
+            bank, account, currency = key
+            partial = ScrapeResults(bank, account,
+                                    transactions={currency: entries})
+            if self.options.journal is not None and not final:
+                self.options.journal.record(partial)
+            account_id = find_account(f'{account}-{currency}', self.client,
+                                      self.metadata)
+            if account_id is None and final:
+                account_id = create_account(partial, currency, self.client,
+                                            self.metadata)
+            if account_id is None:
+                # a new account is opened from its oldest transaction, which
+                # has not necessarily been scraped yet
+                self.deferred.setdefault(key, []).extend(entries)
+                continue
+            if self._due(key):
+                self.reconciling.setdefault(key, []).extend(entries)
+            failures = update_account(
+                account_id, f'{account}-{currency}', partial, currency,
+                self.client, self.batch_options,
+            )
+            self.failures.setdefault(key, []).extend(failures)
+
+    def _created(self, entry_id: str):
+        with self.lock:
+            self.uploaded += 1
+
+    def _due(self, key: Key) -> bool:
+        # decided on the first batch, the reconciliation at close stamps
+        # the account and would make later batches look not due
+        ledger = self.options.ledger
+        if ledger is None:
+            return False
+        if key not in self.checked:
+            self.checked.add(key)
+            _, account, currency = key
+            if self.options.force_reconcile or ledger.reconcile_due(
+                    f'{account}-{currency}', self.options.reconcile_interval):
+                self.reconciling[key] = []
+        return key in self.reconciling
+
+    def _reconcile(self):
+        options = replace(self.options, force_reconcile=True)
+        for key, entries in self.reconciling.items():
+            bank, account, currency = key
+            account_id = find_account(f'{account}-{currency}', self.client,
+                                      self.metadata)
+            if account_id is None or not entries:
+                continue
+            # lists the whole streamed window once, drops what was deleted
+            # in firefly from the ledger and uploads it again
+            self.failures[key] = update_account(
+                account_id, f'{account}-{currency}',
+                ScrapeResults(bank, account, transactions={currency: entries}),
+                currency, self.client, options,
+            )
@@ -0,0 +1,61 @@
+import json
+import unittest
+from os import path
+
+from scraper.dom import parse_html
+from scraper.mizrahi import parse_foreign_transactions, parse_stocks, replay
+
+SNAPSHOTS = path.join(path.dirname(__file__), 'snapshots')
+REPLAY = path.join(SNAPSHOTS, 'replay')
+
+
+def load_expected() -> dict:
+    with open(path.join(SNAPSHOTS, 'replay_expected.json'),
+              encoding='utf-8') as f:
+        return json.load(f)
+
+
+def read_snapshot(name: str) -> str:
+    with open(path.join(REPLAY, name), encoding='utf-8') as f:
+        return f.read()
+
+
+# the recorded pages hide a column and some text the way kendo does, the
+# parses have to match what the browser renders
+class ReplayTest(unittest.TestCase):
+    def test_replay_matches_expected(self):
+        expected = load_expected()
+        result = replay(REPLAY)
+        self.assertEqual(result.bank, expected['bank'])
+        self.assertEqual(result.account, expected['account'])
+        self.assertEqual((result.nis, result.usd, result.eur),
+                         (expected['nis'], expected['usd'], expected['eur']))
+        self.assertEqual(
+            {c: [e.to_dict() for e in entries]
+             for c, entries in result.transactions.items()},
+            expected['transactions'],
+        )
+        self.assertEqual(result.stocks, expected['stocks'])
+
+    def test_hidden_column_is_not_a_cell(self):
+        transactions = parse_foreign_transactions(
+            read_snapshot('foreign_transactions.html')
+        )
+        self.assertEqual([len(v) for v in transactions.values()], [2, 1])
+
+    def test_hidden_text_is_skipped(self):
+        stocks = parse_stocks(read_snapshot('stocks.html'))
+        self.assertEqual([s['bankSymbol'] for s in stocks],
+                         ['629014', '662577'])
+
+    def test_inner_text(self):
+        document = parse_html(
+            '<table><tr><td>a</td><td style="display: none">x</td>'
+            '<td>b</td><td hidden>y</td></tr></table>'
+            '<p>c<span style="color: red; display:none">z</span></p>d<br>e'
+        )
+        self.assertEqual(document.inner_text(), 'a\tb\n\nc\n\nd\ne')
+
+
+if __name__ == '__main__':
+    unittest.main()